@@ -3,11 +3,41 @@ from pathlib import Path
 import os
 from logger import logger
 from datetime import date, datetime
-from utils import find_sunset_time, upload_to_s3, tmp_cleanup, download_from_s3
+from utils import (
+    find_sunset_time,
+    parse_image_time,
+    upload_to_s3,
+    tmp_cleanup,
+    memory_pressure,
+)
+from scoring import (
+    ANALYSIS_SCALES,
+    SCORERS,
+    Frame,
+    get_scorer,
+    laplacian_variance,
+    load_rgb_array,
+    rank_correlation,
+    reduce_array,
+    score_frame,
+)
+from score_cache import ScoreCache
+from sky_roi import SkyROI
+from feature_store import FEATURE_SCALE, FeatureStore
+from dedup import DuplicateFilter
+from score_store import write_day_scores
+from derivatives import DerivativeEncoder
+from metrics import metrics
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 DIR = Path(__file__).parent.resolve()
 
+# Score cache version of the sharpness measure, bump if it changes
+SHARPNESS_VERSION = 1
+
 
 class SunsetDetector:
     """
@@ -20,7 +50,29 @@ class SunsetDetector:
         images: Path = None,
         best_image: Path = None,
         save_method: str = "s3",
+        analysis_scale: int = 1,
+        workers: int = 1,
+        memory_budget_mb: int = 512,
+        score_cache: ScoreCache = None,
+        multi_score: bool = False,
+        derivatives: dict = None,
+        sky_roi: SkyROI = None,
+        feature_store: FeatureStore = None,
+        top_k: int = None,
+        coarse_scale: int = 8,
+        blur_ratio: float = 0.5,
+        dedup: DuplicateFilter = None,
     ):
+        """
+        :param top_k: Score every frame at coarse_scale first and only the
+            top_k candidates at analysis_scale. None scores every frame fully
+        :param coarse_scale: Analysis scale of the coarse pass
+        :param blur_ratio: Candidates sharper than this fraction of the
+            candidates' median sharpness can win; blurrier ones cannot
+        :param dedup: Reuse the score of the last distinct frame for frames
+            this filter finds to be near-duplicates of it, instead of
+            decoding and scoring them in full
+        """
         self.images = Path(images) if isinstance(images, str) else images
         self.best_image = best_image
         self.today_str = images.split("/")[-1] if images else None
@@ -39,11 +91,35 @@ class SunsetDetector:
             "save_method": save_method,
             "num_images": 0,
             "best_image": best_image,
+            "analysis_scale": analysis_scale,
+            "workers": workers,
+            "sky_roi": sky_roi.id if sky_roi else None,
         }
+        self.workers = max(1, workers)
+        self.memory_budget_mb = memory_budget_mb
+        self.cache = score_cache
+        self.multi_score = multi_score
+        self.derivatives = derivatives
+        self.sky_roi = sky_roi
+        self.features = feature_store
+        self.top_k = top_k
+        self.coarse_scale = coarse_scale
+        self.blur_ratio = blur_ratio
+        self.sharpness = {}
+        self.blurred = set()
+        # Frames whose only score is from the coarse pass
+        self.coarse_only = set()
+        self.dedup = dedup
+        self._encoder = None
+        self.change_analysis_scale(analysis_scale)
         self.change_detect_method(detect_method)
         self.change_save_method(save_method)
 
         self.scores = {}
+        self.all_scores = {}
+        self.best_score = 0.0
+        self._stream_executor = None
+        self._stream_futures = []
 
     def __repr__(self):
         return f"SunsetDetector({self.metadata})"
@@ -52,191 +128,638 @@ class SunsetDetector:
         """
         Choose the best sunset image based on color analysis.
 
+        Images already scored while streaming are not scored again, so after a
+        streaming capture this only finalizes the running best.
+
         :param folder_path: Path to the folder containing images
         :return: The filename of the best sunset image
         """
-        best_image = None
-        best_score = 0.0
+        self._drain_stream()
 
         if not self.images or not os.path.exists(self.images):
             logger.error(f"Images path {self.images} does not exist.")
             return False
 
-        image_paths = [
-            f
-            for f in os.listdir(self.images)
-            if f.lower().endswith((".png", ".jpg", ".jpeg"))
-        ]
+        image_paths = self._list_images()
 
         logger.info(f"Found {len(image_paths)} images in {self.images}")
-        self.metadata["num_images"] = len(image_paths)
 
         if len(image_paths) == 0:
             logger.warning("No images found for sunset detection.")
             return False
 
-        logger.info(
-            f"Scoring images for sunset detection using {self.detect.__name__} method."
-        )
-
-        for image_path in image_paths:
-            logger.debug(f"Processing image: {image_path}")
-            score = self.detect(self.images / image_path)
-            logger.debug(f"Image: {image_path}, Score: {score}")
-            self.scores[image_path] = score
-
-            if score > best_score:
-                best_score = score
-                best_image = image_path
+        logger.info(f"Scoring images for sunset detection using {self.scorer} method.")
+
+        unscored = [p for p in image_paths if p not in self.scores]
+        duplicates = {}
+        if unscored and self.dedup:
+            unscored, duplicates = self._split_duplicates(unscored)
+        if unscored:
+            if self._use_coarse_to_fine(unscored):
+                self.scores.update(self._coarse_to_fine(unscored))
+            else:
+                self.scores.update(self._score_images(unscored))
+            if self.cache:
+                self.cache.save()
+        for image_path, reference in duplicates.items():
+            self._reuse_score(image_path, reference)
+        if self.dedup:
+            self.metadata["duplicates"] = self.dedup.stats()
+        if self.features:
+            self.features.flush()
+
+        # Frames scored in memory and never persisted still count as captured
+        self.metadata["num_images"] = len(self.scores)
+
+        # Coarse scores are at a different scale, so frames that were never
+        # rescored in full can't win, and blurred candidates only win if every
+        # frame is blurred
+        fine = [p for p in image_paths if p not in self.coarse_only] or image_paths
+        eligible = [p for p in fine if p not in self.blurred] or fine
+        # max() rather than a running best from 0.0, so an overcast day where
+        # every frame scores 0.0 still gets a best image
+        best_image = max(eligible, key=self.scores.__getitem__)
+        best_score = self.scores[best_image]
 
         logger.info(f"Best image found: {best_image} with score: {best_score:.2f}")
         self.best_image = self.images / best_image
         self.metadata["best_image"] = str(self.best_image)
+        if self.multi_score:
+            self.metadata["all_scores"] = self.all_scores
 
         return True
 
-    def _sunset_detector_red(self, image: Path) -> float:
+    def add_image(self, image: Path) -> float:
+        """
+        Score a single new image and update the running best.
+
+        :param image: Path to an image inside self.images
+        :return: The image's score
+        """
+        image_path = Path(image).name
+        score = self._score_file(image_path)
+        self.scores[image_path] = score
+        if self.cache:
+            self.cache.save()
+        if self.features:
+            self.features.flush()
+        logger.info(f"Streamed image: {image_path}, Score: {score:.2f}")
+
+        if score > self.best_score:
+            self.best_score = score
+            self.best_image = self.images / image_path
+            logger.info(f"New best image so far: {image_path}")
+
+        return score
+
+    def add_frame(self, image: str, pixels) -> bool:
+        """
+        Score an in-memory frame that has not been written to disk.
+
+        :param image: Filename the frame would be saved under in self.images
+        :param pixels: (height, width, 3) uint8 RGB array at full resolution
+        :return: True if the frame is the best so far and should be persisted
+        """
+        # Duplicates are never archived, so their features are all that is kept
+        self._store_features(image, pixels)
+        if self.dedup:
+            reference = self.dedup.check(image, pixels)
+            if reference in self.scores:
+                self._reuse_score(image, reference)
+                return False
+
+        start = time.perf_counter()
+        with metrics.stage("score"):
+            if self.sky_roi:
+                # Crop at full resolution so only the sky is reduced
+                pixels = self.sky_roi.crop(pixels)
+            pixels = reduce_array(pixels, self.analysis_scale)
+            if self.sky_roi:
+                pixels = self.sky_roi.apply(pixels, cropped=True)
+            scores = score_frame(pixels, self._score_methods())
+        metrics.observe("image_latency", time.perf_counter() - start)
+        score = self._record_scores(image, scores)
+        self.scores[image] = score
+        logger.info(f"Scored frame: {image}, Score: {score:.2f}")
+
+        if score > self.best_score:
+            self.best_score = score
+            self.best_image = self.images / image
+            logger.info(f"New best frame so far: {image}")
+            return True
+
+        return False
+
+    def stream_image(self, image: Path) -> None:
+        """
+        Queue a freshly captured image for scoring in the background.
+
+        Frames are scored one at a time, in capture order, on a single worker
+        thread so scoring never delays the capture loop.
+
+        :param image: Path to an image inside self.images
+        """
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(max_workers=1)
+        self._stream_futures.append(self._stream_executor.submit(self.add_image, image))
+
+    def _drain_stream(self) -> None:
+        """
+        Wait for every queued streaming score to finish.
+        """
+        if self._stream_executor is None:
+            return
+
+        for future in self._stream_futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Streaming score failed: {e}")
+        self._stream_executor.shutdown()
+        self._stream_executor = None
+        self._stream_futures = []
+
+    def _split_duplicates(self, image_paths: list) -> tuple:
+        """
+        Find near-duplicate frames from a cheap 1/8 scale decode.
+
+        :param image_paths: Image filenames in self.images, in capture order
+        :return: Tuple of (distinct filenames to score, dict of duplicate
+            filename -> filename of the frame it duplicates)
+        """
+        distinct = []
+        duplicates = {}
+        for image_path in image_paths:
+            reference = self.dedup.duplicate_of(image_path)
+            if reference is None:
+                try:
+                    pixels = load_rgb_array(self.images / image_path, FEATURE_SCALE)
+                except Exception as e:
+                    logger.error(f"Could not hash {image_path}: {e}")
+                    distinct.append(image_path)
+                    continue
+                self._store_features(image_path, pixels, FEATURE_SCALE)
+                reference = self.dedup.check(image_path, pixels)
+
+            if reference is None:
+                distinct.append(image_path)
+            else:
+                duplicates[image_path] = reference
+
+        if duplicates:
+            logger.info(
+                f"Skipping {len(duplicates)} of {len(image_paths)} frames "
+                f"as near-duplicates"
+            )
+        return distinct, duplicates
+
+    def _reuse_score(self, image_path: str, reference: str) -> None:
+        """
+        Give a near-duplicate frame the scores of the frame it duplicates.
+        """
+        self.scores[image_path] = self.scores.get(reference, 0.0)
+        if reference in self.coarse_only:
+            self.coarse_only.add(image_path)
+        if self.multi_score and reference in self.all_scores:
+            self.all_scores[image_path] = self.all_scores[reference]
+        logger.info(f"Frame {image_path} reuses the score of {reference}")
+
+    def _use_coarse_to_fine(self, image_paths: list) -> bool:
+        return bool(
+            self.top_k
+            and len(image_paths) > self.top_k
+            and self.coarse_scale > self.analysis_scale
+        )
+
+    def _coarse_to_fine(self, image_paths: list) -> dict:
+        """
+        Score every frame cheaply, then only the best candidates in full.
+
+        The coarse pass decodes every frame at coarse_scale. The top_k frames
+        by coarse score are then decoded at analysis_scale, rescored and
+        measured for sharpness, and candidates much blurrier than the others
+        are excluded. How far the two rankings agreed is kept in
+        metadata["selection"] and logged when they picked different frames.
+
+        :param image_paths: Image filenames in self.images
+        :return: Dict of image filename -> score, fine scores for candidates
+            and coarse scores for every other frame, which are also added to
+            self.coarse_only
+        """
+        start = time.perf_counter()
+        coarse = self._score_images(image_paths, scale=self.coarse_scale)
+        coarse_s = time.perf_counter() - start
+
+        candidates = sorted(image_paths, key=coarse.get, reverse=True)[: self.top_k]
+        start = time.perf_counter()
+        fine = self._score_images(candidates, sharpness=True)
+        fine_s = time.perf_counter() - start
+        self.coarse_only.update(p for p in image_paths if p not in fine)
+
+        if len(candidates) >= 3:
+            sharpness = sorted(self.sharpness[p] for p in candidates)
+            median = sharpness[len(sharpness) // 2]
+            self.blurred.update(
+                p for p in candidates if self.sharpness[p] < self.blur_ratio * median
+            )
+
+        eligible = [p for p in candidates if p not in self.blurred] or candidates
+        coarse_best = candidates[0]
+        fine_best = max(eligible, key=fine.get)
+        fine_order = sorted(candidates, key=fine.get, reverse=True)
+        selection = {
+            "top_k": self.top_k,
+            "coarse_scale": self.coarse_scale,
+            "candidates": candidates,
+            "coarse_best": coarse_best,
+            "fine_best": fine_best,
+            "agreed": coarse_best == fine_best,
+            "rank_correlation": rank_correlation(candidates, fine_order),
+            "blurred": sorted(self.blurred & set(candidates)),
+            "coarse_s": round(coarse_s, 3),
+            "fine_s": round(fine_s, 3),
+        }
+        self.metadata["selection"] = selection
+
+        if selection["agreed"]:
+            logger.info(
+                f"Coarse and fine passes agree on {fine_best} "
+                f"({coarse_s:.2f}s for {len(image_paths)} frames, "
+                f"{fine_s:.2f}s for {len(candidates)} candidates)"
+            )
+        else:
+            logger.warning(
+                f"Coarse pass ranked {coarse_best} first but the fine pass chose "
+                f"{fine_best} (rank correlation {selection['rank_correlation']:.2f}, "
+                f"blurred: {selection['blurred'] or 'none'})"
+            )
+
+        return {**coarse, **fine}
+
+    def _score_images(
+        self, image_paths: list, scale: int = None, sharpness: bool = False
+    ) -> dict:
+        """
+        Score images, in parallel when more than one worker is configured.
+
+        Scoring runs in a thread pool because both the JPEG decoder and the
+        NumPy reductions release the GIL. The worker count is capped so that
+        the decoded frames in flight fit in memory_budget_mb, and scoring
+        falls back to serial when memory_pressure reports high memory use.
+
+        :param image_paths: Image filenames in self.images
+        :param scale: Analysis scale, defaults to self.analysis_scale
+        :param sharpness: Also measure each frame's sharpness
+        :return: Dict of image filename -> score, in image_paths order
+        """
+        scale = scale or self.analysis_scale
+        score_file = partial(self._score_file, scale=scale, sharpness=sharpness)
+        workers = min(
+            self.workers,
+            len(image_paths),
+            self._memory_bound_workers(image_paths, scale),
+        )
+
+        if workers > 1 and memory_pressure():
+            logger.warning("Memory pressure detected, scoring images serially.")
+            workers = 1
+
+        if workers <= 1:
+            return {p: score_file(p) for p in image_paths}
+
+        logger.info(f"Scoring {len(image_paths)} images with {workers} workers.")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(image_paths, executor.map(score_file, image_paths)))
+
+    def _score_file(
+        self, image_path: str, scale: int = None, sharpness: bool = False
+    ) -> float:
+        """
+        Score one image file, reusing the score cache when the file is unchanged.
+
+        In multi-score mode the image is decoded once and every registered
+        scorer runs on that same frame.
+
+        :param image_path: Image filename in self.images
+        :param scale: Analysis scale, defaults to self.analysis_scale
+        :param sharpness: Also measure the frame's sharpness into
+            self.sharpness, from the same decode
+        :return: The image's score from the selected detect method
+        """
+        image = self.images / image_path
+        scale = scale or self.analysis_scale
+        methods = self._score_methods()
+        versions = {method: SCORERS[method].version for method in methods}
+        if sharpness:
+            versions["sharpness"] = SHARPNESS_VERSION
+
+        scores = {}
+        if self.cache:
+            for method, version in versions.items():
+                score = self.cache.get(
+                    image, method, version, scale, self.metadata["sky_roi"]
+                )
+                if score is not None:
+                    scores[method] = score
+
+        if len(scores) == len(versions):
+            logger.debug(f"Image: {image_path}, cached scores: {scores}")
+            self._store_features(image_path)
+            return self._record_scores(image_path, scores)
+
+        logger.debug(f"Processing image: {image_path}")
+        start = time.perf_counter()
+        try:
+            with metrics.stage("decode", nbytes=os.path.getsize(image)):
+                if sharpness:
+                    # Sharpness needs the 2D crop, before any mask is applied
+                    box = self.sky_roi.box if self.sky_roi else None
+                    pixels = load_rgb_array(image, scale, box=box)
+                else:
+                    pixels = self._load_pixels(image, scale)
+        except Exception as e:
+            logger.error(f"Invalid image path provided: {e}")
+            return 0.0
+
+        with metrics.stage("score"):
+            extra = {}
+            if sharpness:
+                extra["sharpness"] = laplacian_variance(pixels)
+                if self.sky_roi:
+                    pixels = self.sky_roi.apply(pixels, cropped=True)
+            scores = {**score_frame(pixels, methods), **extra}
+        metrics.observe("image_latency", time.perf_counter() - start)
+        logger.debug(f"Image: {image_path}, Scores: {scores}")
+
+        # A sky ROI leaves only part of the frame, so decode it again whole
+        if self.sky_roi:
+            self._store_features(image_path)
+        else:
+            self._store_features(image_path, pixels, scale)
+
+        if self.cache:
+            for method, score in scores.items():
+                self.cache.put(
+                    image,
+                    method,
+                    versions[method],
+                    scale,
+                    score,
+                    self.metadata["sky_roi"],
+                )
+        return self._record_scores(image_path, scores)
+
+    def _load_pixels(self, image: Path, scale: int):
+        """
+        Decode an image for scoring, reduced to its sky pixels if a sky ROI
+        is set.
+        """
+        if self.sky_roi:
+            return self.sky_roi.load(image, scale)
+        return load_rgb_array(image, scale)
+
+    def _store_features(self, image_path: str, pixels=None, scale: int = 1) -> None:
+        """
+        Add a frame's color features to the feature store, once.
+
+        :param image_path: Image filename in self.images
+        :param pixels: The whole frame, decoded at FEATURE_SCALE if not given
+        :param scale: Downscale factor pixels were decoded at
+        """
+        if not self.features or self.features.has(self.today_str, image_path):
+            return
+        try:
+            if pixels is None:
+                pixels = load_rgb_array(self.images / image_path, FEATURE_SCALE)
+            else:
+                pixels = reduce_array(pixels, max(1, FEATURE_SCALE // scale))
+            with metrics.stage("features"):
+                self.features.add(self.today_str, image_path, pixels)
+        except Exception as e:
+            logger.error(f"Could not extract features of {image_path}: {e}")
+
+    def _score_methods(self) -> list:
+        """
+        Scorers to run on each frame, the selected detect method first.
+        """
+        if not self.multi_score:
+            return [self.detect_method]
+        return [self.detect_method] + sorted(set(SCORERS) - {self.detect_method})
+
+    def _record_scores(self, image_path: str, scores: dict) -> float:
+        """
+        Keep every scorer's result for an image and return the selected one.
+        """
+        if "sharpness" in scores:
+            scores = dict(scores)
+            self.sharpness[image_path] = scores.pop("sharpness")
+        if self.multi_score:
+            self.all_scores[image_path] = scores
+        return scores[self.detect_method]
+
+    def _memory_bound_workers(self, image_paths: list, scale: int = None) -> int:
+        """
+        Number of frames that can be decoded at once within the memory budget.
+
+        The estimate uses the first image's header and assumes two RGB copies
+        of each frame (decoded and converted) are alive at the same time.
+
+        :param image_paths: Image filenames in self.images
+        :param scale: Analysis scale, defaults to self.analysis_scale
+        :return: Maximum number of concurrent workers, at least 1
+        """
+        try:
+            with Image.open(self.images / image_paths[0]) as img:
+                width, height = img.size
+        except Exception as e:
+            logger.warning(f"Could not read image size for memory budget: {e}")
+            return 1
+
+        frame_bytes = 2 * 3 * width * height / (scale or self.analysis_scale) ** 2
+        return max(1, int(self.memory_budget_mb * 1024 * 1024 // frame_bytes))
+
+    def _list_images(self) -> list:
+        """
+        List the image filenames in the images folder.
+
+        :return: Sorted list of image filenames
         """
-        return the RGB values of each pixel in the image.
+        if not self.images or not os.path.exists(self.images):
+            return []
+
+        return sorted(
+            f
+            for f in os.listdir(self.images)
+            if f.lower().endswith((".png", ".jpg", ".jpeg"))
+        )
+
+    def _sunset_detector(self, image: Path, scale: int = None) -> float:
+        """
+        Score an image with the selected detect method.
+
+        The image is decoded once into an array and handed to the registered
+        scorer, which works on the whole frame in vectorized passes.
+
+        :param image: Path to the image file
+        :param scale: Decode downscale factor, defaults to self.analysis_scale
         """
         try:
-            img_path = Path(image)
-            img = Image.open(img_path)
+            pixels = self._load_pixels(Path(image), scale or self.analysis_scale)
         except (TypeError, Exception) as e:
             logger.error(f"Invalid image path provided: {e}")
             return 0.0
 
-        img = img.convert("RGB")  # Ensure the image is in RGB mode
-        colors = img.getdata()
-        # average R value
-        average_r = sum(color[0] for color in colors) / len(colors)
-        average_g = sum(color[1] for color in colors) / len(colors)
-        average_b = sum(color[2] for color in colors) / len(colors)
-        logger.debug(f"Average RGB: ({average_r}, {average_g}, {average_b})")
-
-        return average_r
-
-    # def _sunset_detector_cv2(self, image: Path) -> float:
-    #     """
-    #     Detects if an image likely depicts a sunset based on color analysis.
-    #     """
-
-    #     try:
-    #         image = cv2.imread(str(image))
-    #         if image is None:
-    #             raise ValueError("Image not found or invalid format.")
-    #     except Exception as e:
-    #         logger.error(f"Error reading image: {e}")
-    #         return 0.0
-
-    #     hsv_img = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-    #     # Define color ranges for sunset hues (adjust as needed)
-    #     lower_red1 = np.array([0, 100, 100])
-    #     upper_red1 = np.array([10, 255, 255])
-    #     lower_red2 = np.array([160, 100, 100])
-    #     upper_red2 = np.array([180, 255, 255])
-    #     lower_orange = np.array([10, 100, 100])
-    #     upper_orange = np.array([25, 255, 255])
-    #     lower_yellow = np.array([25, 100, 100])
-    #     upper_yellow = np.array([40, 255, 255])
-
-    #     mask_red1 = cv2.inRange(hsv_img, lower_red1, upper_red1)
-    #     mask_red2 = cv2.inRange(hsv_img, lower_red2, upper_red2)
-    #     mask_orange = cv2.inRange(hsv_img, lower_orange, upper_orange)
-    #     mask_yellow = cv2.inRange(hsv_img, lower_yellow, upper_yellow)
-
-    #     combined_mask = mask_red1 + mask_red2 + mask_orange + mask_yellow
-
-    #     # Calculate the percentage of sunset-colored pixels
-    #     sunset_pixel_count = np.sum(combined_mask > 0)
-    #     total_pixels = image.shape[0] * image.shape[1]
-    #     sunset_percentage = sunset_pixel_count / total_pixels
-    #     logger.debug(f"Sunset pixel percentage: {sunset_percentage:.2%}")
-
-    #     return sunset_percentage
-
-    # def _sunset_detector_saturation(self, image: Path) -> float:
-    #     """
-    #     Detects the saturation of an image to determine if it likely depicts a sunset.
-    #     Higher saturation indicates more vivid colors, which is typical for sunsets.
-
-    #     :param image_path: Path to the image file
-    #     :return: A float score indicating the saturation level
-    #     """
-    #     try:
-    #         image = cv2.imread(str(image))
-    #         if image is None:
-    #             raise ValueError("Image not found or invalid format.")
-    #     except Exception as e:
-    #         logger.error(f"Error reading image: {e}")
-    #         return 0.0
-
-    #     # Read the image and convert to HSV to analyze
-    #     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    #     saturation = np.mean(hsv[:, :, 1])
-    #     return saturation  # Higher = more vivid colors
+        return self.scorer(Frame(pixels))
 
     def change_detect_method(self, detect_method: str) -> None:
         """
         Change the detection method.
 
-        :param method: The new method to use ('red', 'cv2', or 'saturation')
+        :param method: Any registered scorer: 'red', 'hue' (alias 'cv2') or
+            'saturation'
         """
-        if detect_method == "red":
-            self.detect = self._sunset_detector_red
-        elif detect_method == "cv2":
-            self.detect = self._sunset_detector_cv2
-        elif detect_method == "saturation":
-            self.detect = self._sunset_detector_saturation
-        else:
-            raise ValueError("Method must be either 'red', 'cv2' or 'saturation'")
-        logger.info(f"Detection method changed to {detect_method}.")
+        self.scorer = get_scorer(detect_method)
+        self.detect = self._sunset_detector
+        self.detect_method = self.scorer.name
+        self.metadata["detect_method"] = self.scorer.name
+        logger.info(f"Detection method changed to {self.scorer.name}.")
 
-    def _save_s3(self) -> bool:
+    def change_analysis_scale(self, analysis_scale: int) -> None:
         """
-        Save the best sunset image to an S3 bucket.
+        Change the resolution images are decoded at for scoring.
 
-        :param save_path: Path where the best image will be saved
-        :return: True if successful, False otherwise
+        :param analysis_scale: Linear downscale factor (1, 2, 4 or 8)
         """
+        if analysis_scale not in ANALYSIS_SCALES:
+            raise ValueError(f"Analysis scale must be one of {ANALYSIS_SCALES}")
+        self.analysis_scale = analysis_scale
+        self.metadata["analysis_scale"] = analysis_scale
+        logger.info(f"Analysis scale changed to 1/{analysis_scale}.")
 
-        # convert to webp
-        self.best_image = str(self.best_image)
-        if not self.best_image.lower().endswith(".webp"):
-            logger.info("Converting best image to webp format.")
-            # Convert the image to webp format
-            try:
-                image = Image.open(self.best_image)
-                image = image.convert("RGB")
-                webp_path = self.best_image.replace(".jpg", ".webp")
-                image.save(webp_path, "webp")
-                self.best_image = webp_path
-                logger.info(f"Converted image saved as {self.best_image}")
-                ext = "webp"
-            except Exception as e:
-                logger.error(f"Error converting image to webp: {e}")
-                ext = "jpg"
+    def score_drift(self, scales: tuple = (2, 4, 8)) -> dict:
+        """
+        Compare reduced-resolution scores against full-resolution scoring.
+
+        For every scale, reports the time spent scoring, the mean and max
+        absolute score drift, and whether the same best frame is chosen.
+
+        :param scales: Analysis scales to compare against scale 1
+        :return: Dict of scale -> drift report
+        """
+        image_paths = self._list_images()
+        if not image_paths:
+            logger.warning("No images found to measure score drift.")
+            return {}
+
+        def score_all(scale: int) -> tuple:
+            start = time.perf_counter()
+            scores = {p: self.detect(self.images / p, scale=scale) for p in image_paths}
+            return scores, time.perf_counter() - start
+
+        full_scores, full_seconds = score_all(1)
+        full_best = max(image_paths, key=lambda p: full_scores[p])
+
+        report = {
+            1: {
+                "seconds": full_seconds,
+                "mean_abs_drift": 0.0,
+                "max_abs_drift": 0.0,
+                "best_image": full_best,
+                "same_best": True,
+            }
+        }
+        for scale in scales:
+            scores, seconds = score_all(scale)
+            drifts = [abs(scores[p] - full_scores[p]) for p in image_paths]
+            best = max(image_paths, key=lambda p: scores[p])
+            report[scale] = {
+                "seconds": seconds,
+                "mean_abs_drift": sum(drifts) / len(drifts),
+                "max_abs_drift": max(drifts),
+                "best_image": best,
+                "same_best": best == full_best,
+            }
 
-        save_path = f"{self.today_str}/best_sunset.{ext}"
-        # Placeholder for S3 saving logic
-        logger.info(f"Saving best image to S3 at {save_path}")
+        for scale, stats in report.items():
+            logger.info(
+                f"Scale 1/{scale}: {stats['seconds']:.2f}s, "
+                f"mean drift {stats['mean_abs_drift']:.3f}, "
+                f"max drift {stats['max_abs_drift']:.3f}, "
+                f"best {stats['best_image']} (same as full: {stats['same_best']})"
+            )
+
+        return report
+
+    def _save_s3(self) -> bool:
+        """
+        Start encoding the best sunset image into its webp derivatives
+        (thumbnail, medium, full) and uploading them to S3.
+
+        Encoding and uploads run in the background; call finish_save() to
+        wait for them.
+
+        :return: True if the encoding was started, False otherwise
+        """
         if not self.best_image:
             logger.error("No best image found to save.")
             return False
-        upload_to_s3(self.best_image, s3_object=save_path)
 
-        # upload metadata to s3
-        metadata_path = f"tmp/{self.today_str}/metadata.json"
-        # Create directory if it doesn't exist
-        metadata_dir = os.path.dirname(metadata_path)
-        if not os.path.exists(metadata_dir):
-            os.makedirs(metadata_dir)
+        logger.info(f"Encoding webp derivatives of {self.best_image} for S3")
+        self._encoder = DerivativeEncoder(self.derivatives)
+        self._encoder.start(
+            self.best_image,
+            out_dir=f"{DIR}/tmp/{self.today_str}",
+            s3_prefix=self.today_str,
+        )
+        return True
+
+    def finish_save(self) -> bool:
+        """
+        Wait for the background derivative encoding and uploads to finish.
+
+        :return: True if every derivative was uploaded (or nothing was pending)
+        """
+        if self._encoder is None:
+            return True
+
+        try:
+            results = self._encoder.wait()
+        except Exception as e:
+            logger.error(f"Error encoding webp derivatives: {e}")
+            return False
+        finally:
+            self._encoder = None
+
+        self.metadata["derivatives"] = {
+            name: result["bytes"] for name, result in results.items()
+        }
+        if results.get("full", {}).get("path"):
+            self.best_image = results["full"]["path"]
+        return all(result["uploaded"] for result in results.values())
 
-        with open(metadata_path, "w") as f:
-            json.dump(self.metadata, f, indent=4)
-        upload_to_s3(metadata_path, s3_object=f"{self.today_str}/metadata.json")
+    def write_metadata(self) -> bool:
+        """
+        Write the run metadata, including this run's metrics, to
+        tmp/<day>/metadata.json, and upload it when saving to S3.
 
+        :return: True if successful, False otherwise
+        """
+        metadata_path = f"{DIR}/tmp/{self.today_str}/metadata.json"
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+
+        self.metadata["metrics"] = metrics.to_dict()
+        try:
+            with open(metadata_path, "w") as f:
+                json.dump(self.metadata, f, indent=4)
+            logger.info(f"Metadata saved to {metadata_path}")
+        except Exception as e:
+            logger.error(f"Error saving metadata: {e}")
+            return False
+
+        if self.metadata["save_method"] == "s3":
+            return upload_to_s3(
+                metadata_path, s3_object=f"{self.today_str}/metadata.json"
+            )
         return True
 
     def _save_local(self) -> bool:
@@ -262,16 +785,6 @@ class SunsetDetector:
             img.save(save_path)
             logger.info(f"Best image saved to {save_path}")
 
-            # upload metadata to s3
-            metadata_path = f"{DIR}/tmp/{self.today_str}/metadata.json"
-            if not os.path.exists(os.path.dirname(f"{DIR}/tmp/{self.today_str}")):
-                os.makedirs(os.path.dirname(f"{DIR}/tmp/{self.today_str}"))
-
-            with open(metadata_path, "w") as f:
-                json.dump(self.metadata, f, indent=4)
-
-            logger.info(f"Metadata saved to {metadata_path}")
-
             return True
         except Exception as e:
             logger.error(f"Error saving best image: {e}")
@@ -307,86 +820,68 @@ class SunsetDetector:
         normalized_scores = {k: float(v) for k, v in self.scores.items()}
         return sorted(normalized_scores.items(), key=lambda x: x[1], reverse=True)
 
-    def update_metadata(self) -> None:
-        """
-        update metadata
-        * scores for new run
-        * best image path
-        * time of sunset
+    def scores_entry(self, offset_resolution: int = 6) -> dict:
         """
+        Build this run's entry for the historical scores.
 
-        # Download existing metadata from S3 if it exists
-        s3_metadata_path = "scores.json"
-        local_metadata_path = f"{DIR}/tmp/scores.json"
+        Frames only scored by the coarse pass keep their coarse_scale score,
+        which is close to the full-scale one for channel-mean scorers, so the
+        day's series stays complete. Their offsets are listed under
+        "coarse_offsets", and max_score only counts fully scored frames.
 
-        # convert time in "%Y%m%d_%H%M" to minutes before or after self.sunset_time
-        # Create a new metadata structure with time till sunset as keys
+        :param offset_resolution: Resolution of the score time offsets, in
+            seconds. The default gives offsets like "-12.4" (minutes)
+
+        :return: Dict of {today: {"scores", "max_score", "best_image_time",
+            "min_to_sunset"}}, plus "coarse_offsets" after a top_k run
+        """
+        # Offsets are exact minutes before (-) or after sunset, at
+        # offset_resolution seconds, since the capture cadence can vary
+        sunset_time = datetime.strptime(self.sunset_time, "%Y-%m-%d_%H:%M:%S")
         time_based_scores = {}
+        coarse_offsets = []
         for image, score in self.scores.items():
-            timestamp_str = image.split(".")[0]  # Remove file extension
-            timestamp = datetime.strptime(timestamp_str, "%Y%m%d_%H%M")
-            sunset_time = datetime.strptime(self.sunset_time, "%Y-%m-%d_%H:%M:%S")
-            minutes_diff = (timestamp - sunset_time).total_seconds() / 60
-            # TODO change if take photos at different times
-            # round to closest 5 minutes
-            minutes_diff = round(minutes_diff / 5) * 5  # Round to nearest 5 minutes
-
-            time_based_scores[int(minutes_diff)] = float(score)
-
-        best_image_time = datetime.strptime(
-            self.best_image.split("/")[-1].split(".")[0], "%Y%m%d_%H%M"
-        )
-
+            seconds = (parse_image_time(image) - sunset_time).total_seconds()
+            seconds = round(seconds / offset_resolution) * offset_resolution
+            # JSON object keys are strings, so store them that way up front
+            offset = f"{round(seconds / 60, 2):g}"
+            time_based_scores[offset] = float(score)
+            if image in self.coarse_only:
+                coarse_offsets.append(offset)
+
+        fine_scores = [
+            score
+            for image, score in self.scores.items()
+            if image not in self.coarse_only
+        ] or list(self.scores.values())
+
+        best_image_time = parse_image_time(str(self.best_image))
         best_image_time_fmt = best_image_time.strftime("%I:%M %p")
-        min_to_sunset = (
-            best_image_time - datetime.strptime(self.sunset_time, "%Y-%m-%d_%H:%M:%S")
-        ).total_seconds() / 60
+        min_to_sunset = (best_image_time - sunset_time).total_seconds() / 60
         min_to_sunset = round(min_to_sunset)
 
-        new_metadata = {
-            self.today_str: {
-                "scores": time_based_scores,
-                "max_score": max(self.scores.values(), default=0.0),
-                "best_image_time": best_image_time_fmt,
-                "min_to_sunset": min_to_sunset,
-            }
+        entry = {
+            "scores": time_based_scores,
+            "max_score": max(fine_scores, default=0.0),
+            "best_image_time": best_image_time_fmt,
+            "min_to_sunset": min_to_sunset,
         }
+        if coarse_offsets:
+            entry["coarse_offsets"] = sorted(coarse_offsets, key=float)
+        return {self.today_str: entry}
 
-        try:
-            download_from_s3(local_metadata_path, s3_metadata_path)
-            logger.info(f"Existing metadata found in S3 at {s3_metadata_path}")
-
-            with open(local_metadata_path, "r") as f:
-                existing_metadata = json.load(f)
-
-            # Add new scores to existing metadata
-            existing_metadata[self.today_str] = new_metadata[self.today_str]
-
-            # Write updated metadata back to file
-            with open(local_metadata_path, "w") as f:
-                json.dump(existing_metadata, f, indent=4)
-
-            # Upload updated metadata back to S3
-            upload_to_s3(local_metadata_path, s3_object=s3_metadata_path)
-
-            logger.info("Updated metadata uploaded to S3 successfully.")
-
-            return True
-        except Exception as e:
-            logger.error(f"Error downloading metadata from S3: {e}")
-
-        # If no existing metadata, create a new one
-        if not os.path.exists(local_metadata_path):
-            logger.info("No existing metadata found, creating new metadata.")
-            with open(local_metadata_path, "w") as f:
-                json.dump({}, f, indent=4)
-
-            with open(local_metadata_path, "w") as f:
-                json.dump(new_metadata, f, indent=4)
-
-            upload_to_s3(local_metadata_path, s3_object=s3_metadata_path)
+    def update_metadata(self) -> bool:
+        """
+        update metadata
+        * scores for new run
+        * best image path
+        * time of sunset
 
-            return True
+        Only this day's month shard and the shard index are rewritten, each
+        with an ETag-conditional write. The aggregate is rebuilt separately.
+        """
+        with metrics.stage("scores_merge"):
+            return write_day_scores(self.scores_entry())
 
     def run(self) -> bool:
         """
@@ -409,9 +904,16 @@ class SunsetDetector:
             logger.error("Failed to save the best sunset image.")
             return False
 
+        # Runs while the webp derivatives are encoded and uploaded
         self.update_metadata()
         logger.info("Updated metadata.")
 
+        if not self.finish_save():
+            logger.error("Failed to upload every webp derivative.")
+
+        self.write_metadata()
+        metrics.write()
+
         logger.info("Sunset detection and saving completed successfully.")
 
         return True
@@ -0,0 +1,306 @@
+"""
+Re-score past days and publish them to scores.json in one write.
+
+Day folders come from a date range under a local root or an S3 prefix, or
+are listed explicitly. Frames are scored within the camera's stored sky ROI,
+like live days, so both kinds of entries compare. Days are scored in parallel
+and each finished day is appended to a progress file as it completes, so an
+interrupted backfill picks up where it stopped. Once every day is done, all
+entries are merged with a single write_day_scores call, and the aggregate is
+rebuilt if that left it behind by more than one month shard.
+
+    python backfill.py --start 2025-06-01 --end 2025-08-31 --method hue
+    python backfill.py --root s3://thesunset/images --start 2025-07-01
+    python backfill.py tmp/2025-07-04 tmp/2025-07-05 --dry-run
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from SunsetDetector import SunsetDetector
+from camera_session import CameraSession
+from feature_store import FeatureStore
+from logger import logger
+from score_cache import ScoreCache
+from score_store import rebuild_if_stale, write_day_scores
+from scoring import SCORERS
+from sky_roi import SkyROI, get_sky_roi
+from utils import download_from_s3, get_s3_client
+
+DIR = Path(__file__).parent.resolve()
+STAGING_DIR = DIR / "tmp" / "backfill"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def day_range(start: date, end: date) -> list:
+    """
+    Every day from start to end, inclusive, as "%Y-%m-%d" strings.
+    """
+    return [
+        (start + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((end - start).days + 1)
+    ]
+
+
+def resolve_sources(days: list, root: str) -> dict:
+    """
+    Map each day to its folder under a local root or an s3://bucket/prefix root.
+
+    :return: Dict of day -> local folder path or s3:// URL
+    """
+    if root.startswith("s3://"):
+        return {day: f"{root.rstrip('/')}/{day}" for day in days}
+    return {day: str(Path(root) / day) for day in days if (Path(root) / day).is_dir()}
+
+
+def stage_folder(source: str) -> Path:
+    """
+    Local folder holding a day's images, downloading them first for S3 sources.
+
+    :param source: Local day folder, or s3://bucket/prefix/<day>
+    :return: Path to a local folder named after the day
+    """
+    if not source.startswith("s3://"):
+        return Path(source)
+
+    bucket, _, prefix = source[len("s3://") :].partition("/")
+    folder = STAGING_DIR / prefix.rstrip("/").split("/")[-1]
+    os.makedirs(folder, exist_ok=True)
+
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix.rstrip("/") + "/"):
+        for obj in page.get("Contents", []):
+            name = obj["Key"].split("/")[-1]
+            local_file = folder / name
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if local_file.exists() and local_file.stat().st_size == obj["Size"]:
+                continue
+            download_from_s3(str(local_file), obj["Key"], bucket=bucket)
+    return folder
+
+
+class Backfill:
+    """
+    Re-scores a set of day folders with one detect method and analysis scale.
+
+    Progress is kept in tmp/backfill_<method>_s<scale>.jsonl (with the sky
+    ROI id appended when there is one), one JSON line per finished day, so
+    runs with the same settings resume each other.
+    """
+
+    def __init__(
+        self,
+        sources: dict,
+        detect_method: str = "red",
+        analysis_scale: int = 1,
+        workers: int = 2,
+        upload_best: bool = False,
+        score_cache: ScoreCache = None,
+        progress_path: Path = None,
+        feature_store: FeatureStore = None,
+        top_k: int = None,
+        sky_roi: SkyROI = None,
+    ):
+        self.sources = sources
+        self.detect_method = detect_method
+        self.analysis_scale = analysis_scale
+        self.workers = max(1, workers)
+        self.upload_best = upload_best
+        self.cache = score_cache
+        self.features = feature_store
+        self.top_k = top_k
+        self.sky_roi = sky_roi
+        region = f"_r{sky_roi.id}" if sky_roi else ""
+        self.progress_path = Path(
+            progress_path
+            or DIR / "tmp" / f"backfill_{detect_method}_s{analysis_scale}{region}.jsonl"
+        )
+        self.done = self._load_progress()
+
+    def __repr__(self):
+        return (
+            f"Backfill({len(self.sources)} days, {self.detect_method}, "
+            f"1/{self.analysis_scale}, {len(self.done)} done)"
+        )
+
+    def _load_progress(self) -> dict:
+        """
+        Read finished days from the progress file.
+
+        :return: Dict of day -> progress record
+        """
+        done = {}
+        try:
+            with open(self.progress_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by an interruption; that day reruns
+                        continue
+                    done[record["day"]] = record
+        except FileNotFoundError:
+            pass
+        return done
+
+    def _append_progress(self, record: dict) -> None:
+        os.makedirs(self.progress_path.parent, exist_ok=True)
+        with open(self.progress_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def score_day(self, day: str) -> dict:
+        """
+        Score one day's folder and build its scores entry.
+
+        :return: Progress record with "day", "status" and, on success, "entry"
+        """
+        folder = stage_folder(self.sources[day])
+        detector = SunsetDetector(
+            detect_method=self.detect_method,
+            images=str(folder),
+            save_method="s3" if self.upload_best else "local",
+            analysis_scale=self.analysis_scale,
+            score_cache=self.cache,
+            feature_store=self.features,
+            top_k=self.top_k,
+            sky_roi=self.sky_roi,
+        )
+        if not detector.choose_best_sunset():
+            return {"day": day, "status": "empty"}
+
+        if self.upload_best:
+            detector.save()
+            detector.finish_save()
+
+        entry = detector.scores_entry()[day]
+        if self.sources[day].startswith("s3://"):
+            shutil.rmtree(folder, ignore_errors=True)
+        return {"day": day, "status": "scored", "entry": entry}
+
+    def run(self, publish: bool = True) -> dict:
+        """
+        Score every day not already in the progress file, then publish.
+
+        :param publish: Merge the entries into scores.json when done
+        :return: Dict of day -> scores entry for every scored day
+        """
+        pending = sorted(day for day in self.sources if day not in self.done)
+        logger.info(
+            f"Backfilling {len(pending)} day(s) with {self.detect_method} "
+            f"({len(self.done)} already done) using {self.workers} workers"
+        )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.score_day, day): day for day in pending}
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # Not recorded, so the day is retried on the next run
+                    logger.error(f"Backfill of {day} failed: {e}")
+                    continue
+
+                self._append_progress(record)
+                self.done[day] = record
+                if self.cache:
+                    self.cache.save()
+                max_score = record.get("entry", {}).get("max_score", 0.0)
+                logger.info(f"Backfilled {day}: {record['status']} ({max_score:.2f})")
+
+        entries = {
+            day: record["entry"]
+            for day, record in sorted(self.done.items())
+            if day in self.sources and record["status"] == "scored"
+        }
+        if publish and entries:
+            if not write_day_scores(entries):
+                logger.error("Failed to publish backfilled scores.")
+            else:
+                rebuild_if_stale()
+        return entries
+
+
+def main(args) -> int:
+    if args.folders:
+        # Normalized so a trailing slash from shell completion doesn't leave
+        # SunsetDetector with an empty day
+        folders = [
+            f.rstrip("/") if f.startswith("s3://") else str(Path(f))
+            for f in args.folders
+        ]
+        sources = {Path(f).name: f for f in folders}
+    else:
+        start = datetime.strptime(args.start, "%Y-%m-%d").date()
+        end = datetime.strptime(args.end, "%Y-%m-%d").date() if args.end else start
+        sources = resolve_sources(day_range(start, end), args.root)
+
+    if not sources:
+        logger.error("No day folders to backfill.")
+        return 1
+
+    sky_roi = get_sky_roi(args.camera_key)
+    if sky_roi is None:
+        logger.warning(f"No sky ROI stored for {args.camera_key}, scoring whole frames")
+
+    backfill = Backfill(
+        sources,
+        detect_method=args.method,
+        analysis_scale=args.scale,
+        workers=args.workers,
+        upload_best=args.upload_best,
+        score_cache=ScoreCache(),
+        feature_store=None if args.no_features else FeatureStore(),
+        top_k=args.top_k,
+        sky_roi=sky_roi,
+    )
+    if args.fresh and backfill.progress_path.exists():
+        backfill.progress_path.unlink()
+        backfill.done = {}
+
+    entries = backfill.run(publish=not args.dry_run)
+    logger.info(f"Backfill finished with {len(entries)} scored day(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("folders", nargs="*", help="Day folders named YYYY-MM-DD")
+    parser.add_argument("--start", help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", help="Last day, YYYY-MM-DD (default: --start)")
+    parser.add_argument(
+        "--root", default=str(DIR / "tmp"), help="Local folder or s3://bucket/prefix"
+    )
+    parser.add_argument("--method", default="red", choices=sorted(SCORERS))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--upload-best", action="store_true")
+    parser.add_argument(
+        "--camera-key",
+        default=CameraSession(source="rpi").key,
+        help="Camera configuration whose sky ROI to score within",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=None,
+        help="Score every frame at 1/8 first, then only this many in full",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--fresh", action="store_true")
+    parser.add_argument(
+        "--no-features", action="store_true", help="Don't fill the feature store"
+    )
+    args = parser.parse_args()
+    if not args.folders and not args.start:
+        parser.error("Give day folders or --start")
+    sys.exit(main(args))
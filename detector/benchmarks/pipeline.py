@@ -0,0 +1,196 @@
+"""
+Benchmark the detection and publishing pipeline on synthetic sunset frames.
+
+For every resolution and frame count, writes FakeCamera frames into a day
+folder and runs SunsetDetector.run with local save against a local moto S3,
+then the S3 save path on its own. Reports per-stage wall time, peak RSS and
+images per second, and can save or compare against a JSON baseline.
+
+    python benchmarks/pipeline.py --resolutions 820x616,3280x2464 --counts 10
+    python benchmarks/pipeline.py --save-baseline
+    python benchmarks/pipeline.py --compare --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from common import DETECTOR_DIR, local_s3, use_fake_credentials
+
+use_fake_credentials()
+
+import psutil  # noqa: E402
+from fake_camera import save_fake_frames  # noqa: E402
+from SunsetDetector import SunsetDetector  # noqa: E402
+
+# Timings only compare on the same kind of machine, so baselines are per arch
+BASELINE = Path(__file__).parent / "baselines" / f"pipeline-{platform.machine()}.json"
+DAY = "2000-06-21"
+STAGES = ("choose_best_sunset", "save", "update_metadata")
+
+
+class PeakRSS:
+    """
+    Samples this process's RSS on a background thread to find a stage's peak.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+@contextmanager
+def measure(results: dict, stage: str):
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+    results[stage] = {
+        "wall_s": round(elapsed, 4),
+        "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+    }
+
+
+def timed(detector: SunsetDetector, results: dict) -> None:
+    """
+    Wrap the detector's stage methods so run() records each one.
+    """
+    for stage in STAGES:
+        method = getattr(detector, stage)
+
+        def wrapper(method=method, stage=stage):
+            with measure(results, stage):
+                return method()
+
+        setattr(detector, stage, wrapper)
+
+
+def bench_case(workdir: Path, size: tuple, count: int, workers: int) -> dict:
+    day_folder = workdir / f"{size[0]}x{size[1]}" / DAY
+    save_fake_frames(day_folder, count, size=size)
+
+    stages = {}
+    detector = SunsetDetector(
+        images=str(day_folder), save_method="local", workers=workers
+    )
+    timed(detector, stages)
+    with measure(stages, "run"):
+        ok = detector.run()
+
+    # The S3 save path (webp derivatives + uploads) on its own, from the chosen frame
+    with measure(stages, "_save_s3"):
+        detector._save_s3()
+        detector.finish_save()
+
+    return {
+        "resolution": f"{size[0]}x{size[1]}",
+        "frames": count,
+        "workers": workers,
+        "ok": ok,
+        "stages": stages,
+        "images_per_s": round(count / stages["choose_best_sunset"]["wall_s"], 2),
+    }
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    List stages that got slower than baseline by more than `tolerance`.
+    """
+    previous = {(r["resolution"], r["frames"], r["workers"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result["resolution"], result["frames"], result["workers"]))
+        if not base:
+            continue
+        for stage, stats in result["stages"].items():
+            before = base["stages"].get(stage, {}).get("wall_s")
+            if before and stats["wall_s"] > before * (1 + tolerance):
+                regressions.append(
+                    f"{result['resolution']} x{result['frames']} {stage}: "
+                    f"{before:.3f}s -> {stats['wall_s']:.3f}s"
+                )
+    return regressions
+
+
+def main(args) -> int:
+    sizes = [tuple(int(v) for v in r.split("x")) for r in args.resolutions.split(",")]
+    counts = [int(c) for c in args.counts.split(",")]
+
+    results = []
+    with local_s3(), tempfile.TemporaryDirectory() as workdir:
+        # Metadata is written to DETECTOR_DIR/tmp/<day>, removed afterwards
+        try:
+            for size in sizes:
+                for count in counts:
+                    result = bench_case(Path(workdir), size, count, args.workers)
+                    results.append(result)
+                    stages = ", ".join(
+                        f"{stage} {stats['wall_s']:.3f}s/{stats['peak_rss_mb']:.0f}MB"
+                        for stage, stats in result["stages"].items()
+                    )
+                    print(
+                        f"{result['resolution']:>9} x{count:<3} "
+                        f"{result['images_per_s']:>7.2f} img/s | {stages}"
+                    )
+        finally:
+            shutil.rmtree(DETECTOR_DIR / "tmp" / DAY, ignore_errors=True)
+
+    report = {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resolutions", default="820x616,1640x1232,3280x2464")
+    parser.add_argument("--counts", default="10")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    sys.exit(main(parser.parse_args()))
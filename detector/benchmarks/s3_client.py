@@ -0,0 +1,79 @@
+"""
+Benchmark the shared S3 client against a new boto3 Session per call.
+
+Replays the transfers of one SunsetDetector.run (webp, metadata.json and
+scores.json uploads plus the scores.json download) against a local moto
+server, first the old way and then with utils.get_s3_client.
+
+    python benchmarks/s3_client.py --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from common import BUCKET, local_s3, use_fake_credentials
+
+use_fake_credentials()
+
+import boto3  # noqa: E402
+import utils  # noqa: E402
+
+TRANSFERS = [
+    ("upload", "best_sunset.webp", 400_000),
+    ("upload", "metadata.json", 400),
+    ("upload", "scores.json", 60_000),
+    ("download", "scores.json", None),
+]
+
+
+def session_per_call_client():
+    session = boto3.Session(
+        aws_access_key_id="testing", aws_secret_access_key="testing"
+    )
+    return session.client("s3", endpoint_url=os.environ["S3_ENDPOINT_URL"])
+
+
+def replay(folder: str, client_factory) -> float:
+    start = time.perf_counter()
+    for direction, name, _ in TRANSFERS:
+        s3 = client_factory()
+        path = os.path.join(folder, name)
+        if direction == "upload":
+            s3.upload_file(Filename=path, Bucket=BUCKET, Key=f"bench/{name}")
+        else:
+            s3.download_file(Bucket=BUCKET, Key=f"bench/{name}", Filename=path)
+    return time.perf_counter() - start
+
+
+def main(runs: int) -> dict:
+    with local_s3(), tempfile.TemporaryDirectory() as folder:
+        for _, name, size in TRANSFERS:
+            if size:
+                with open(os.path.join(folder, name), "wb") as f:
+                    f.write(os.urandom(size))
+
+        results = {}
+        for label, factory in (
+            ("session_per_call", session_per_call_client),
+            ("shared_client", utils.get_s3_client),
+        ):
+            replay(folder, factory)  # warm up
+            timings = [replay(folder, factory) for _ in range(runs)]
+            results[label] = {
+                "median_s": statistics.median(timings),
+                "mean_s": statistics.mean(timings),
+            }
+            print(
+                f"{label:>17}: median {results[label]['median_s'] * 1000:.1f} ms "
+                f"per run ({len(TRANSFERS)} transfers)"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20)
+    main(parser.parse_args().runs)
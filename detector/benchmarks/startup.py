@@ -0,0 +1,157 @@
+"""
+Benchmark scheduler startup: import time and idle RSS of scheduler.main.
+
+Each sample runs in a fresh interpreter that imports scheduler, enters
+scheduler.main and stops at its first sleep, which is where the scheduler
+spends most of the day. It reports the import time, the time to reach that
+sleep, the resident memory while idle and which heavy dependencies were
+loaded. With --check it fails if any of them were, or if the limits given
+are exceeded.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --check --max-rss-mb 40
+    python benchmarks/startup.py --importtime
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import DETECTOR_DIR
+
+# Dependencies that should only load once a capture window starts
+HEAVY_MODULES = ("boto3", "botocore", "astral", "PIL", "numpy", "psutil", "picamera2")
+
+CHILD = r"""
+import json, os, sys, time
+from pathlib import Path
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+start = time.perf_counter()
+import scheduler
+imported = time.perf_counter()
+
+state_dir = Path(sys.argv[1])
+scheduler.DIR = state_dir
+scheduler.STATE_FILE = state_dir / "tmp" / "last_run.json"
+
+class Idle(Exception):
+    pass
+
+class IdleClock(scheduler.Clock):
+    def sleep(self, seconds):
+        print(json.dumps({
+            "import_s": imported - start,
+            "to_idle_s": time.perf_counter() - start,
+            "idle_rss_mb": rss_mb(),
+            "heavy_modules": sorted(
+                m for m in sys.argv[2].split(",") if m in sys.modules
+            ),
+        }))
+        raise Idle()
+
+try:
+    scheduler.main(clock=IdleClock(), run_fn=lambda **kwargs: False)
+except Idle:
+    pass
+"""
+
+
+def child_env() -> dict:
+    path = [str(DETECTOR_DIR), os.environ.get("PYTHONPATH")]
+    return {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, path))}
+
+
+def sample(state_dir: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, state_dir, ",".join(HEAVY_MODULES)],
+        cwd=state_dir,
+        env=child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def importtime(top: int = 15) -> list:
+    """
+    Slowest imports of scheduler by cumulative time, from python -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import scheduler"],
+        cwd=tempfile.gettempdir(),
+        env=child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(args) -> int:
+    with tempfile.TemporaryDirectory() as state_dir:
+        # The first run may build the sun table; only warm starts are measured
+        sample(state_dir)
+        samples = [sample(state_dir) for _ in range(args.runs)]
+
+    report = {
+        "import_s": statistics.median(s["import_s"] for s in samples),
+        "to_idle_s": statistics.median(s["to_idle_s"] for s in samples),
+        "idle_rss_mb": statistics.median(s["idle_rss_mb"] for s in samples),
+        "heavy_modules": sorted({m for s in samples for m in s["heavy_modules"]}),
+    }
+    print(
+        f"import {report['import_s'] * 1000:.0f} ms, "
+        f"main() idle after {report['to_idle_s'] * 1000:.0f} ms, "
+        f"idle RSS {report['idle_rss_mb']:.1f} MB "
+        f"(median of {args.runs})"
+    )
+    print(f"heavy modules loaded while idle: {report['heavy_modules'] or 'none'}")
+
+    if args.importtime:
+        for cumulative, name in importtime():
+            print(f"{cumulative / 1000:>8.1f} ms {name}")
+
+    if args.check:
+        failures = []
+        if report["heavy_modules"]:
+            failures.append(f"loaded at startup: {', '.join(report['heavy_modules'])}")
+        if args.max_import_s and report["import_s"] > args.max_import_s:
+            failures.append(f"import took {report['import_s']:.2f}s")
+        if args.max_rss_mb and report["idle_rss_mb"] > args.max_rss_mb:
+            failures.append(f"idle RSS {report['idle_rss_mb']:.1f} MB")
+        for failure in failures:
+            print(f"FAIL {failure}")
+        return 1 if failures else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--max-import-s", type=float, default=None)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+from collections import deque
+
+from logger import logger
+
+
+class AdaptiveCadence:
+    """
+    Picks the interval before the next capture from the recent score trend.
+
+    The interval is halved while scores are climbing and grown by half
+    while they plateau or fall, always within [min_interval, max_interval].
+    The frame budget also sets a floor: the interval is only shortened while
+    enough frames are left to cover the rest of the window at max_interval,
+    so the budget lasts the window and min_interval is reachable until the
+    budget runs low.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 60,
+        max_interval: float = 300,
+        frame_budget: int = 30,
+        window: int = 3,
+        rise: float = 0.02,
+    ):
+        """
+        :param min_interval: Shortest interval between captures, in seconds
+        :param max_interval: Longest interval between captures, in seconds
+        :param frame_budget: Most frames to capture in one window
+        :param window: Number of recent scores the trend is computed over
+        :param rise: Relative change per frame that counts as climbing
+        """
+        if min_interval > max_interval:
+            raise ValueError("min_interval must not exceed max_interval")
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.frame_budget = frame_budget
+        self.rise = rise
+        self.recent = deque(maxlen=max(2, window))
+        self.frames = 0
+        self.interval = max_interval
+
+    def __repr__(self):
+        return (
+            f"AdaptiveCadence({self.min_interval}-{self.max_interval}s, "
+            f"{self.frames}/{self.frame_budget} frames)"
+        )
+
+    def observe(self, score: float) -> None:
+        """
+        Record the score of the frame just captured.
+        """
+        self.frames += 1
+        if score is not None:
+            self.recent.append(float(score))
+
+    def trend(self) -> float:
+        """
+        Mean change per frame over the recent scores, relative to their mean.
+        """
+        if len(self.recent) < 2:
+            return 0.0
+        scores = list(self.recent)
+        mean = sum(scores) / len(scores)
+        if mean == 0:
+            return 0.0
+        return (scores[-1] - scores[0]) / (len(scores) - 1) / mean
+
+    @property
+    def exhausted(self) -> bool:
+        return self.frames >= self.frame_budget
+
+    def next_interval(self, seconds_left: float) -> float:
+        """
+        Seconds to wait before the next capture.
+
+        :param seconds_left: Time left in the capture window
+        """
+        trend = self.trend()
+        if trend > self.rise:
+            self.interval /= 2
+        else:
+            self.interval *= 1.5
+
+        # Frames left after the next one must cover the rest at max_interval
+        frames_left = max(1, self.frame_budget - self.frames)
+        reserve = (frames_left - 1) * self.max_interval
+        floor = max(self.min_interval, seconds_left - reserve)
+        self.interval = min(self.max_interval, max(floor, self.interval))
+
+        logger.info(
+            f"Score trend {trend:+.3f}/frame, next capture in {self.interval:.0f}s"
+        )
+        return self.interval
@@ -0,0 +1,196 @@
+import time
+
+from logger import logger
+from metrics import metrics
+from fake_camera import FakeCamera
+
+try:
+    from picamera2 import Picamera2
+    from libcamera import controls
+except ImportError:
+    # Off-device: only the simulated sources are available
+    Picamera2 = None
+    controls = None
+
+
+class CameraSession:
+    """
+    One camera kept streaming for a whole capture window.
+
+    open() configures a single streaming mode, starts the camera and
+    self-tests it by grabbing a few frames, so it can run a few minutes
+    before the window starts. After that each capture is a frame grab from
+    the running stream rather than a mode switch. A failed grab restarts the
+    stream in place (reopening the camera only if that fails too) and is
+    retried straight away, so the capture slot is not lost.
+
+    Implements capture_array and capture_file, so it can be passed wherever a
+    Picamera2 is expected.
+    """
+
+    def __init__(
+        self,
+        source: str = "rpi",
+        size: tuple = (3280, 2464),
+        self_test_frames: int = 2,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0,
+        camera_factory=None,
+    ):
+        """
+        :param source: 'rpi' for the Picamera2 module or 'fake' for FakeCamera
+        :param size: Stream size as (width, height)
+        :param self_test_frames: Frames grabbed and checked when opening
+        :param max_attempts: Attempts to open the camera, and grab attempts per
+            capture slot
+        :param retry_delay: Seconds between open attempts
+        :param camera_factory: Function returning a new camera object,
+            overriding source, e.g. to inject a FlakyCamera
+        """
+        self.source = source
+        self.size = size
+        self.self_test_frames = self_test_frames
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.camera_factory = camera_factory
+        self.camera = None
+        self.config = None
+        self.restarts = 0
+        self.reopens = 0
+
+    def __repr__(self):
+        state = "open" if self.camera else "closed"
+        return (
+            f"CameraSession({self.source}, {state}, "
+            f"restarts={self.restarts}, reopens={self.reopens})"
+        )
+
+    @property
+    def key(self) -> str:
+        """
+        Identifies the camera configuration, e.g. for its stored sky ROI.
+        """
+        return f"{self.source}-{self.size[0]}x{self.size[1]}"
+
+    def __enter__(self):
+        if not self.camera:
+            self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _new_camera(self):
+        if self.camera_factory:
+            return self.camera_factory()
+        if self.source == "fake":
+            return FakeCamera()
+        if Picamera2 is None:
+            raise RuntimeError("picamera2 is not installed")
+        return Picamera2()
+
+    def _configure(self, camera) -> None:
+        # A video configuration streams continuously; BGR888 arrays come
+        # back in R, G, B byte order
+        if hasattr(camera, "create_video_configuration"):
+            self.config = camera.create_video_configuration(
+                main={"size": self.size, "format": "BGR888"}, buffer_count=2
+            )
+        else:
+            self.config = camera.create_still_configuration(main={"size": self.size})
+        camera.configure(self.config)
+        if controls:
+            camera.set_controls({"AwbMode": controls.AwbModeEnum.Daylight})
+
+    def _self_test(self, camera) -> None:
+        for _ in range(self.self_test_frames):
+            frame = camera.capture_array("main")
+            if frame is None or frame.ndim != 3 or not frame.any():
+                raise RuntimeError("Camera self-test returned an empty frame")
+
+    def open(self) -> "CameraSession":
+        """
+        Create, configure, start and self-test the camera.
+
+        :raises Exception: If every attempt fails
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            camera = None
+            start = time.perf_counter()
+            try:
+                logger.info(f"Opening camera ({attempt}/{self.max_attempts})")
+                camera = self._new_camera()
+                self._configure(camera)
+                camera.start()
+                self._self_test(camera)
+                self.camera = camera
+                metrics.record("camera_open", time.perf_counter() - start)
+                logger.info("Camera warmed up and self-tested")
+                return self
+            except Exception as e:
+                logger.error(f"Camera open attempt {attempt} failed: {str(e)}")
+                self._shutdown(camera)
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_delay)
+
+        raise Exception(f"Failed to open camera after {self.max_attempts} attempts")
+
+    def _shutdown(self, camera) -> None:
+        if camera is None:
+            return
+        try:
+            camera.stop()
+            camera.close()
+        except Exception:
+            pass
+
+    def _restart(self) -> None:
+        """
+        Restart the stream with the same configuration, reopening the camera
+        if that is not enough.
+        """
+        start = time.perf_counter()
+        try:
+            self.camera.stop()
+            self.camera.start()
+            self.restarts += 1
+            logger.warning("Camera stream restarted")
+        except Exception as e:
+            logger.error(f"Camera restart failed, reopening: {str(e)}")
+            self._shutdown(self.camera)
+            self.camera = None
+            self.reopens += 1
+            self.open()
+        metrics.record("camera_recover", time.perf_counter() - start)
+
+    def capture_array(self, name: str = "main"):
+        """
+        Grab the next frame from the stream, recovering within this slot.
+
+        :return: (height, width, channels) uint8 array
+        :raises Exception: If the frame could not be grabbed after recovery
+        """
+        if self.camera is None:
+            self.open()
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.camera.capture_array(name)
+            except Exception as e:
+                logger.error(f"Frame grab {attempt} failed: {str(e)}")
+                if attempt == self.max_attempts:
+                    raise
+                self._restart()
+
+    def capture_file(self, filepath: str) -> None:
+        """
+        Grab a frame and encode it to a file.
+        """
+        from PIL import Image
+
+        Image.fromarray(self.capture_array("main")[..., :3]).save(filepath)
+
+    def close(self) -> None:
+        self._shutdown(self.camera)
+        self.camera = None
+        logger.info(f"Camera closed: {self}")
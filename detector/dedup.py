@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+from logger import logger
+
+# Frames are subsampled to about this many pixels on their short side before
+# hashing, so hashing a full-resolution frame costs next to nothing
+HASH_SOURCE = 64
+
+
+def dhash(pixels: np.ndarray, hash_size: int = 8) -> tuple:
+    """
+    Difference hash of a frame, plus its mean color.
+
+    The frame is shrunk to (hash_size + 1) x hash_size gray pixels and each
+    bit records whether a pixel is brighter than its right neighbor. That
+    captures the scene's structure but not its color, which is what changes
+    over a sunset, so the mean color is returned alongside.
+
+    :param pixels: (height, width, 3) uint8 RGB array at any scale
+    :return: Tuple of (hash as an int, (mean R, mean G, mean B))
+    """
+    step = max(1, min(pixels.shape[:2]) // HASH_SOURCE)
+    small = np.ascontiguousarray(pixels[::step, ::step, :3])
+    gray = np.asarray(
+        Image.fromarray(small)
+        .convert("L")
+        .resize((hash_size + 1, hash_size), Image.BOX),
+        dtype=np.int16,
+    )
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    color = tuple(float(c) for c in small.reshape(-1, 3).mean(axis=0))
+    return value, color
+
+
+class DuplicateFilter:
+    """
+    Spots frames that are near-duplicates of the last distinct frame.
+
+    Each frame is compared with the most recent frame that was not itself a
+    duplicate, so a slow drift over many frames still registers as change.
+    A frame is a duplicate when its dHash differs in at most threshold bits
+    and its mean color by at most color_tolerance on every channel.
+    """
+
+    def __init__(
+        self, threshold: int = 4, color_tolerance: float = 4.0, hash_size: int = 8
+    ):
+        """
+        :param threshold: Most differing hash bits for a near-duplicate, out
+            of hash_size squared
+        :param color_tolerance: Most difference in mean R, G or B, 0-255
+        :param hash_size: Hash side length, the hash has hash_size ** 2 bits
+        """
+        self.threshold = threshold
+        self.color_tolerance = color_tolerance
+        self.hash_size = hash_size
+        self.reference = None
+        self.duplicates = {}
+        self.checked = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"DuplicateFilter(threshold={self.threshold}, "
+            f"{len(self.duplicates)}/{self.checked} skipped)"
+        )
+
+    def check(self, name: str, pixels: np.ndarray) -> str:
+        """
+        Compare a frame with the last distinct frame.
+
+        :param name: Frame filename
+        :param pixels: (height, width, 3) uint8 RGB array at any scale
+        :return: Filename of the frame this one duplicates, or None if it is
+            distinct, in which case it becomes the new reference. Checking
+            the same frame again returns the same answer
+        """
+        value, color = dhash(pixels, self.hash_size)
+        with self._lock:
+            if name in self.duplicates:
+                return self.duplicates[name]
+            if self.reference and self.reference[0] == name:
+                return None
+            self.checked += 1
+            if self.reference:
+                ref_name, ref_value, ref_color = self.reference
+                distance = bin(value ^ ref_value).count("1")
+                shift = max(abs(a - b) for a, b in zip(color, ref_color))
+                if distance <= self.threshold and shift <= self.color_tolerance:
+                    self.duplicates[name] = ref_name
+                    logger.info(
+                        f"{name} is a near-duplicate of {ref_name} "
+                        f"({distance} bits, color shift {shift:.1f})"
+                    )
+                    return ref_name
+            self.reference = (name, value, color)
+            return None
+
+    def duplicate_of(self, name: str) -> str:
+        """
+        Filename of the frame a frame duplicates, or None.
+        """
+        return self.duplicates.get(name)
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "checked": self.checked,
+            "skipped": len(self.duplicates),
+        }
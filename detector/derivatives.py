@@ -0,0 +1,151 @@
+"""
+Background encoding of the best image into a set of webp derivatives.
+
+Each derivative is a resized webp with its own quality and encoding effort
+(PIL's webp `method`, 0 = fastest, 6 = smallest). They are encoded smallest
+first on a background thread and each one is uploaded as soon as it is
+written, so the thumbnail the web app shows first is available long before
+the full-resolution image is done. If the full-size webp cannot be
+encoded, the source image is uploaded as best_sunset.jpg instead, as before
+derivatives existed.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PIL import Image
+
+from logger import logger
+from metrics import metrics
+from utils import upload_to_s3
+
+# name -> (max width in px or None for full size, webp quality, webp method)
+DERIVATIVES = {
+    "thumb": (320, 70, 4),
+    "medium": (1280, 78, 4),
+    "full": (None, 80, 4),
+}
+
+
+def derivative_name(name: str) -> str:
+    """
+    File name of a derivative. The full size keeps the original
+    best_sunset.webp name so existing links keep working.
+    """
+    return "best_sunset.webp" if name == "full" else f"best_sunset_{name}.webp"
+
+
+def encode_derivative(
+    image: Image.Image, path: str, width: int = None, quality: int = 80, method=4
+) -> int:
+    """
+    Resize an RGB image to `width` (keeping its aspect ratio) and save it as webp.
+
+    :return: Size of the written file in bytes
+    """
+    start = time.perf_counter()
+    if width and image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+    image.save(path, "webp", quality=quality, method=method)
+
+    nbytes = os.path.getsize(path)
+    metrics.record("webp_encode", time.perf_counter() - start, nbytes)
+    return nbytes
+
+
+class DerivativeEncoder:
+    """
+    Encodes and uploads the derivatives of one image off the caller's thread.
+
+    Call start() and carry on with other work, then wait() for the result.
+    """
+
+    def __init__(self, derivatives: dict = None, upload_workers: int = 3):
+        self.derivatives = derivatives or DERIVATIVES
+        self._executor = ThreadPoolExecutor(max_workers=1 + upload_workers)
+        self._encode_future = None
+
+    def start(self, source: str, out_dir: str, s3_prefix: str = None) -> None:
+        """
+        Begin encoding `source` into `out_dir`.
+
+        :param s3_prefix: Upload each derivative under this prefix as soon as
+            it is written, or None to only write them locally
+        """
+        self._encode_future = self._executor.submit(
+            self._encode_all, str(source), str(out_dir), s3_prefix
+        )
+
+    def _encode_all(self, source: str, out_dir: str, s3_prefix: str) -> dict:
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            with Image.open(source) as image:
+                image = image.convert("RGB")
+        except Exception as e:
+            logger.error(f"Error reading {source} for webp encoding: {e}")
+            image = None
+
+        results = {}
+        # Smallest first, so the images the web app loads first land first
+        order = sorted(
+            self.derivatives.items(), key=lambda item: item[1][0] or float("inf")
+        )
+        for name, (width, quality, method) in order:
+            path = os.path.join(out_dir, derivative_name(name))
+            try:
+                if image is None:
+                    raise ValueError("source image could not be read")
+                nbytes = encode_derivative(image, path, width, quality, method)
+            except Exception as e:
+                logger.error(f"Error encoding {name} webp: {e}")
+                if width is None:
+                    results[name] = self._fallback(source, s3_prefix)
+                else:
+                    results[name] = {"path": None, "bytes": 0, "upload": None}
+                continue
+
+            logger.info(f"Encoded {name} webp {path} ({nbytes} bytes)")
+            upload = None
+            if s3_prefix is not None:
+                upload = self._executor.submit(
+                    upload_to_s3, path, f"{s3_prefix}/{derivative_name(name)}"
+                )
+            results[name] = {"path": path, "bytes": nbytes, "upload": upload}
+        return results
+
+    def _fallback(self, source: str, s3_prefix: str) -> dict:
+        """
+        Upload the source image itself in place of the full-size webp.
+        """
+        logger.info(f"Uploading {source} as best_sunset.jpg instead")
+        upload = None
+        if s3_prefix is not None:
+            upload = self._executor.submit(
+                upload_to_s3, source, f"{s3_prefix}/best_sunset.jpg"
+            )
+        return {"path": source, "bytes": os.path.getsize(source), "upload": upload}
+
+    def wait(self) -> dict:
+        """
+        Wait for every derivative to be encoded and uploaded.
+
+        :return: Dict of name -> {"path", "bytes", "uploaded"}
+        """
+        if self._encode_future is None:
+            return {}
+
+        results = self._encode_future.result()
+        uploads = [r["upload"] for r in results.values() if r["upload"]]
+        wait(uploads)
+        self._executor.shutdown()
+
+        return {
+            name: {
+                "path": r["path"],
+                "bytes": r["bytes"],
+                "uploaded": r["upload"].result() if r["upload"] else False,
+            }
+            for name, r in results.items()
+        }
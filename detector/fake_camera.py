@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+class FakeCamera:
+    """
+    A stand-in for Picamera2 that renders synthetic sunset frames.
+
+    Implements the subset of the Picamera2 API used by image_capture so the
+    capture pipeline can run without camera hardware. Each frame is a sky
+    gradient whose warmth rises and falls over `period` captures, plus noise.
+    """
+
+    def __init__(self, size: tuple = (820, 616), period: int = 10, seed: int = 0):
+        self.size = size
+        self.period = period
+        self.frames_captured = 0
+        self.started = False
+        self.controls = {}
+        self._rng = np.random.default_rng(seed)
+
+    def create_still_configuration(self, main: dict = None, **kwargs) -> dict:
+        return {"main": {"size": self.size, **(main or {})}, **kwargs}
+
+    def create_video_configuration(self, main: dict = None, **kwargs) -> dict:
+        return {"main": {"size": self.size, **(main or {})}, **kwargs}
+
+    def configure(self, config: dict) -> None:
+        self.size = tuple(config["main"]["size"])
+
+    def set_controls(self, controls: dict) -> None:
+        self.controls.update(controls)
+
+    def start(self) -> None:
+        self.started = True
+
+    def stop(self) -> None:
+        self.started = False
+
+    def close(self) -> None:
+        self.started = False
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        """
+        Render the next frame as a (height, width, 3) uint8 RGB array.
+        """
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+
+        width, height = self.size
+        phase = (self.frames_captured % self.period) / max(1, self.period - 1)
+        warmth = 1.0 - abs(2 * phase - 1)  # peaks mid-period
+        self.frames_captured += 1
+
+        sky = np.linspace(1.0, 0.4, height, dtype=np.float32)[:, None]
+        frame = np.empty((height, width, 3), dtype=np.float32)
+        frame[..., 0] = (90 + 150 * warmth) * sky
+        frame[..., 1] = (80 + 60 * warmth) * sky
+        frame[..., 2] = (140 - 80 * warmth) * sky
+        frame += self._rng.normal(0, 6, frame.shape).astype(np.float32)
+
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+    def capture_file(self, filepath: str) -> None:
+        Image.fromarray(self.capture_array()).save(filepath)
+
+    def __repr__(self):
+        return f"FakeCamera(size={self.size}, frames={self.frames_captured})"
+
+
+class FlakyCamera(FakeCamera):
+    """
+    A FakeCamera that fails on demand, for testing camera recovery.
+
+    :param start_failures: Number of start() calls that raise before one works
+    :param capture_failures: Indices of capture_array calls that raise
+    :param wedge_at: Capture index from which every capture raises until the
+        camera is stopped and started again, like a stalled pipeline
+    """
+
+    def __init__(
+        self,
+        start_failures: int = 0,
+        capture_failures: tuple = (),
+        wedge_at: int = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.start_failures = start_failures
+        self.capture_failures = set(capture_failures)
+        self.wedge_at = wedge_at
+        self.wedged = False
+        self.capture_calls = 0
+        self.starts = 0
+
+    def start(self) -> None:
+        self.starts += 1
+        if self.start_failures > 0:
+            self.start_failures -= 1
+            raise RuntimeError("Simulated camera start failure")
+        self.wedged = False
+        super().start()
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        call = self.capture_calls
+        self.capture_calls += 1
+        if self.wedge_at is not None and call == self.wedge_at:
+            self.wedged = True
+        if self.wedged or call in self.capture_failures:
+            raise RuntimeError(f"Simulated capture failure on call {call}")
+        return super().capture_array(name)
+
+
+def save_fake_frames(folder: Path, count: int, size: tuple = (820, 616)) -> list:
+    """
+    Write `count` synthetic frames named like real captures into `folder`.
+
+    :param folder: Day folder to write into
+    :param count: Number of frames
+    :param size: Frame size as (width, height)
+    :return: List of written paths
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    camera = FakeCamera(size=size, period=count)
+    camera.start()
+
+    start = datetime.strptime(f"{folder.name} 19:00", "%Y-%m-%d %H:%M")
+    paths = []
+    for i in range(count):
+        timestamp = start + timedelta(minutes=5 * i)
+        path = folder / f"{timestamp.strftime('%Y%m%d_%H%M%S')}.jpg"
+        camera.capture_file(str(path))
+        paths.append(path)
+    return paths
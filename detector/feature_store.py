@@ -0,0 +1,236 @@
+"""
+Per-frame color features, kept after the raw frames are gone.
+
+Each frame's RGB and HSV histograms, channel moments and a small thumbnail
+are extracted once, when it is scored, and stored per day as a NumPy
+structured array in features/<day>.npy. Day files are memory-mapped on
+load, so new scoring ideas can be evaluated over months of history without
+decoding a single JPEG.
+
+    python feature_store.py evaluate hue --start 2025-06-01 --end 2025-08-31
+    python feature_store.py extract tmp/2025-07-01 tmp/2025-07-02
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from logger import logger
+from scoring import Frame, get_scorer, load_rgb_array, rgb_to_hsv
+
+DIR = Path(__file__).parent.resolve()
+
+HIST_BINS = 16
+THUMB_SIZE = (64, 48)
+# Features are extracted from frames decoded at this scale
+FEATURE_SCALE = 8
+
+FEATURE_DTYPE = np.dtype(
+    [
+        ("name", "U32"),
+        # Fraction of pixels per bin, R, G, B and H, S, V
+        ("rgb_hist", "<f4", (3, HIST_BINS)),
+        ("hsv_hist", "<f4", (3, HIST_BINS)),
+        # Mean and standard deviation of R, G, B, H, S, V
+        ("mean", "<f4", (6,)),
+        ("std", "<f4", (6,)),
+        ("thumb", "u1", (THUMB_SIZE[1], THUMB_SIZE[0], 3)),
+    ]
+)
+
+# Upper bound of each HSV channel, on OpenCV's 8-bit scales
+HSV_RANGES = (180, 256, 256)
+
+
+def extract_features(name: str, pixels: np.ndarray) -> np.ndarray:
+    """
+    Compute the stored features of one frame.
+
+    :param name: Frame filename
+    :param pixels: (height, width, 3) uint8 RGB array, ideally at FEATURE_SCALE
+    :return: One FEATURE_DTYPE record
+    """
+    record = np.zeros((), dtype=FEATURE_DTYPE)
+    record["name"] = name
+
+    flat = pixels.reshape(-1, 3)
+    hsv = np.stack(rgb_to_hsv(flat), axis=1)
+    count = max(1, flat.shape[0])
+    for channel in range(3):
+        record["rgb_hist"][channel] = (
+            np.bincount(flat[:, channel] // (256 // HIST_BINS), minlength=HIST_BINS)
+            / count
+        )
+        bins = (hsv[:, channel] * HIST_BINS / HSV_RANGES[channel]).astype(np.intp)
+        record["hsv_hist"][channel] = (
+            np.bincount(np.minimum(bins, HIST_BINS - 1), minlength=HIST_BINS) / count
+        )
+
+    channels = np.concatenate([flat.astype(np.float32), hsv], axis=1)
+    record["mean"] = channels.mean(axis=0)
+    record["std"] = channels.std(axis=0)
+    record["thumb"] = np.asarray(Image.fromarray(pixels).resize(THUMB_SIZE, Image.BOX))
+    return record
+
+
+class FeatureStore:
+    """
+    Day files of per-frame features.
+
+    Frames are added from the scoring threads and buffered in memory;
+    flush() merges them into each day's file, which is rewritten atomically.
+    """
+
+    def __init__(self, root: Path = DIR / "features"):
+        self.root = Path(root)
+        self._pending = {}
+        self._stored = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"FeatureStore({self.root}, days={len(self.days())})"
+
+    def path(self, day: str) -> Path:
+        return self.root / f"{day}.npy"
+
+    def days(self, start: str = None, end: str = None) -> list:
+        """
+        Days with stored features, optionally within [start, end].
+        """
+        if not self.root.exists():
+            return []
+        days = sorted(p.stem for p in self.root.glob("*.npy"))
+        return [d for d in days if (not start or d >= start) and (not end or d <= end)]
+
+    def load(self, day: str) -> np.ndarray:
+        """
+        A day's features, memory-mapped, sorted by frame name.
+
+        :return: FEATURE_DTYPE array, empty if the day has none
+        """
+        try:
+            features = np.load(self.path(day), mmap_mode="r")
+        except FileNotFoundError:
+            return np.zeros(0, dtype=FEATURE_DTYPE)
+        if features.dtype != FEATURE_DTYPE:
+            logger.warning(f"Ignoring features for {day} with an old layout")
+            return np.zeros(0, dtype=FEATURE_DTYPE)
+        return features
+
+    def has(self, day: str, name: str) -> bool:
+        with self._lock:
+            if name in self._pending.get(day, {}):
+                return True
+            if day not in self._stored:
+                self._stored[day] = set(self.load(day)["name"])
+            return name in self._stored[day]
+
+    def add(self, day: str, name: str, pixels: np.ndarray) -> None:
+        """
+        Extract and buffer the features of one frame until the next flush().
+        """
+        record = extract_features(name, pixels)
+        with self._lock:
+            self._pending.setdefault(day, {})[name] = record
+
+    def flush(self) -> bool:
+        """
+        Write buffered features into their day files.
+
+        :return: True if successful, False otherwise
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        ok = True
+        for day, records in pending.items():
+            try:
+                existing = {str(r["name"]): r for r in self.load(day)}
+                existing.update(records)
+                features = np.array(
+                    [existing[name] for name in sorted(existing)], dtype=FEATURE_DTYPE
+                )
+                os.makedirs(self.root, exist_ok=True)
+                tmp_path = self.path(day).with_suffix(".npy.tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, features)
+                os.replace(tmp_path, self.path(day))
+                with self._lock:
+                    self._stored[day] = set(existing)
+                logger.info(f"Stored features of {len(records)} frames for {day}")
+            except Exception as e:
+                logger.error(f"Error storing features for {day}: {e}")
+                ok = False
+        return ok
+
+    def evaluate(self, scorer, start: str = None, end: str = None) -> dict:
+        """
+        Score every stored frame without decoding any image.
+
+        :param scorer: Name of a registered scorer, run on each thumbnail, or
+            a function of a day's FEATURE_DTYPE array returning one score per
+            frame
+        :return: Dict of day -> {frame name: score}
+        """
+        score_day = scorer
+        if isinstance(scorer, str):
+            registered = get_scorer(scorer)
+
+            def score_day(features):
+                return [registered(Frame(thumb)) for thumb in features["thumb"]]
+
+        results = {}
+        for day in self.days(start, end):
+            features = self.load(day)
+            if len(features):
+                results[day] = dict(
+                    zip(features["name"].tolist(), map(float, score_day(features)))
+                )
+        return results
+
+
+def main(args) -> int:
+    store = FeatureStore(Path(args.root))
+
+    if args.command == "extract":
+        for folder in map(Path, args.folders):
+            for image in sorted(folder.iterdir()):
+                if image.suffix.lower() not in (".jpg", ".jpeg", ".png"):
+                    continue
+                if not store.has(folder.name, image.name):
+                    store.add(
+                        folder.name, image.name, load_rgb_array(image, FEATURE_SCALE)
+                    )
+        return 0 if store.flush() else 1
+
+    start = time.perf_counter()
+    results = store.evaluate(args.method, args.start, args.end)
+    seconds = time.perf_counter() - start
+    for day, scores in results.items():
+        best = max(scores, key=scores.get)
+        print(f"{day}  {best}  {scores[best]:.4f}  ({len(scores)} frames)")
+    frames = sum(len(scores) for scores in results.values())
+    print(f"Scored {frames} frames over {len(results)} days in {seconds:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--root", default=str(DIR / "features"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    evaluate = commands.add_parser("evaluate", help="Score stored features")
+    evaluate.add_argument("method", help="Registered scorer name")
+    evaluate.add_argument("--start", help="First day, YYYY-MM-DD")
+    evaluate.add_argument("--end", help="Last day, YYYY-MM-DD")
+
+    extract = commands.add_parser("extract", help="Store features of day folders")
+    extract.add_argument("folders", nargs="+")
+
+    sys.exit(main(parser.parse_args()))
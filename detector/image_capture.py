@@ -1,69 +1,31 @@
 from datetime import datetime
 import time
+from typing import Callable
 
-from picamera2 import Picamera2
-from libcamera import controls
 from pathlib import Path
 import os
+from PIL import Image
 from utils import logger
+from metrics import metrics
+from cadence import AdaptiveCadence
+from storage import StorageManager
+from camera_session import CameraSession, Picamera2
+from dedup import DuplicateFilter
 
 DIR = Path(__file__).parent.resolve()
 
 
-def initialize_camera(max_retries: int = 3, retry_delay: int = 5) -> Picamera2:
+def initialize_camera(
+    max_retries: int = 3, retry_delay: int = 5, source: str = "rpi"
+) -> CameraSession:
     """
-    Initialize camera with retry logic and error handling
-    """
-    camera = None
-
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Camera initialization attempt {attempt + 1}/{max_retries}")
-
-            # Create camera instance
-            camera = Picamera2()
-
-            # Configure camera
-            config = camera.create_still_configuration(main={"size": (3280, 2464)})
-            camera.configure(config)
-
-            # Set camera controls
-            camera.set_controls({"AwbMode": controls.AwbModeEnum.Daylight})
+    Open a warmed-up, self-tested camera session
 
-            # Start camera
-            camera.start()
-
-            # Test capture to ensure camera is working
-            logger.info("Testing camera with a test capture...")
-            time.sleep(2)  # Give camera time to initialize
-
-            logger.info("Camera initialized successfully!")
-            return camera
-
-        except Exception as e:
-            logger.error(
-                f"Camera initialization attempt {attempt + 1} failed: {str(e)}"
-            )
-
-            # Clean up failed camera instance
-            if camera:
-                try:
-                    camera.stop()
-                    camera.close()
-                except Exception:
-                    pass
-                camera = None
-
-            if attempt < max_retries - 1:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                logger.error("All camera initialization attempts failed!")
-                raise Exception(
-                    f"Failed to initialize camera after {max_retries} attempts"
-                )
-
-    return camera
+    :param source: 'rpi' for the Picamera2 module or 'fake' for FakeCamera
+    """
+    return CameraSession(
+        source=source, max_attempts=max_retries, retry_delay=retry_delay
+    ).open()
 
 
 def capture_single_image(
@@ -74,7 +36,11 @@ def capture_single_image(
     """
     for attempt in range(max_retries):
         try:
+            start = time.perf_counter()
             camera.capture_file(str(filepath))
+            metrics.record(
+                "capture", time.perf_counter() - start, os.path.getsize(filepath)
+            )
             logger.info(f"Image captured successfully: {filepath}")
             return True
         except Exception as e:
@@ -87,26 +53,130 @@ def capture_single_image(
     return False
 
 
+def capture_single_frame(camera: Picamera2, max_retries: int = 3):
+    """
+    Grab a single frame as an RGB array with retry logic, without encoding it
+
+    CameraSession streams in BGR888, which Picamera2 returns in R, G, B byte
+    order.
+
+    :return: (height, width, 3) uint8 array, or None if every attempt failed
+    """
+    for attempt in range(max_retries):
+        try:
+            with metrics.stage("capture"):
+                frame = camera.capture_array("main")
+            return frame[..., :3]
+        except Exception as e:
+            logger.error(f"Frame capture attempt {attempt + 1} failed: {str(e)}")
+            if attempt < max_retries - 1:
+                time.sleep(1)  # Brief delay before retry
+    logger.error(f"Failed to capture frame after {max_retries} attempts")
+    return None
+
+
+def save_frame(frame, filepath: Path, quality: int = 90) -> bool:
+    """
+    Encode an in-memory frame to a JPEG on disk
+    """
+    try:
+        with metrics.stage("jpeg_encode"):
+            Image.fromarray(frame).save(str(filepath), "JPEG", quality=quality)
+        logger.info(f"Frame saved: {filepath}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save frame {filepath}: {str(e)}")
+        return False
+
+
+def capture_in_memory(
+    camera: Picamera2,
+    filepath: Path,
+    on_frame: Callable[[str, object], bool],
+    archive: bool = False,
+    dedup: DuplicateFilter = None,
+) -> bool:
+    """
+    Grab a frame, score it in memory and persist it only when needed
+
+    :param on_frame: Scorer returning True if the frame should be kept
+    :param archive: Persist the frame even if it is not a candidate
+    :param dedup: Don't archive frames this filter finds to be near-duplicates
+    :return: True if the frame was captured
+    """
+    frame = capture_single_frame(camera)
+    if frame is None:
+        return False
+
+    if dedup and dedup.check(filepath.name, frame):
+        archive = False
+
+    try:
+        keep = on_frame(filepath.name, frame)
+    except Exception as e:
+        logger.error(f"Frame scoring failed, keeping frame: {str(e)}")
+        keep = True
+
+    if keep or archive:
+        save_frame(frame, filepath)
+    else:
+        logger.info(f"Frame {filepath.name} scored in memory, not persisted")
+
+    return True
+
+
 def capture_images(
     start_time: datetime,
     end_time: datetime,
     source: str = "rpi",
     frequency: int = 2,
     export_path: Path = DIR / "tmp",
+    on_capture: Callable[[Path], None] = None,
+    on_frame: Callable[[str, object], bool] = None,
+    archive_every: int = 0,
+    cadence: AdaptiveCadence = None,
+    score_lookup: Callable[[str], float] = None,
+    storage: StorageManager = None,
+    session: CameraSession = None,
+    dedup: DuplicateFilter = None,
 ) -> bool:
     """
     Capture images around sunset time with robust error handling
+
+    :param source: 'rpi' for the Picamera2 module or 'fake' for FakeCamera
+    :param on_capture: Optional callback given each image path as soon as it
+        is written, e.g. SunsetDetector.stream_image for streaming scoring.
+        Not used together with on_frame
+    :param on_frame: Optional in-memory scorer, e.g. SunsetDetector.add_frame.
+        When given, frames are grabbed as arrays and only written to disk if
+        on_frame returns True (a best-so-far candidate) or they are archived
+    :param archive_every: With on_frame, also persist every Nth frame (0 = never)
+    :param cadence: Optional AdaptiveCadence choosing the interval after each
+        capture from the score trend instead of the fixed frequency. Capture
+        stops early once its frame budget is spent
+    :param score_lookup: Score of a captured frame by filename for the
+        cadence, e.g. SunsetDetector.scores.get
+    :param session: CameraSession to capture from, ideally opened a few
+        minutes before start_time. One is opened here if not given. It is
+        closed when capture ends
+    :param storage: Optional StorageManager asked to make room before each
+        capture. Frames are skipped while free space is below its threshold
+    :param dedup: With on_frame, a DuplicateFilter whose near-duplicate frames
+        are not archived. Share it with the SunsetDetector so they also reuse
+        the earlier frame's score instead of being scored
     """
 
     today = start_time.strftime("%Y-%m-%d")
     os.makedirs(export_path / today, exist_ok=True)
 
-    if source == "rpi":
+    if source in ("rpi", "fake"):
         camera = None
 
         try:
-            # Initialize camera with retry logic
-            camera = initialize_camera()
+            # Reuse the pre-warmed session if there is one
+            camera = session or CameraSession(source=source)
+            if camera.camera is None:
+                camera.open()
 
             logger.info("Camera started successfully")
             logger.info(f"Capturing images from {start_time} to {end_time}")
@@ -121,42 +191,72 @@ def capture_images(
                 current_time = datetime.now(tz=datetime.now().astimezone().tzinfo)
 
                 if current_time >= start_time:
-                    timestamp = current_time.strftime("%Y%m%d_%H%M")
+                    # Seconds included, the adaptive cadence can go below a minute
+                    timestamp = current_time.strftime("%Y%m%d_%H%M%S")
                     filepath = export_path / today / f"{timestamp}.jpg"
 
                     logger.info(f"Capturing image at {timestamp}")
 
-                    if capture_single_image(camera, filepath):
+                    if storage and not storage.reserve():
+                        logger.error(f"Skipping capture at {timestamp}, disk is full")
+                        captured = False
+                    elif on_frame:
+                        captured = capture_in_memory(
+                            camera,
+                            filepath,
+                            on_frame,
+                            archive=bool(
+                                archive_every
+                                and successful_captures % archive_every == 0
+                            ),
+                            dedup=dedup,
+                        )
+                    else:
+                        captured = capture_single_image(camera, filepath)
+
+                    if captured and storage:
+                        storage.track(filepath)
+
+                    if captured:
                         successful_captures += 1
+                        if on_capture and not on_frame:
+                            try:
+                                on_capture(filepath)
+                            except Exception as e:
+                                logger.error(f"Capture callback failed: {str(e)}")
                     else:
+                        # The session already retried within this slot
                         failed_captures += 1
 
-                        # If we have too many failed captures in a row, try to reinitialize camera
-                        if failed_captures >= 3:
-                            logger.warning(
-                                "Multiple capture failures detected, attempting camera reinitialization..."
+                    if cadence:
+                        if captured:
+                            cadence.observe(
+                                score_lookup(filepath.name) if score_lookup else None
                             )
-                            try:
-                                camera.stop()
-                                camera.close()
-                                time.sleep(2)
-                                camera = initialize_camera()
-                                failed_captures = (
-                                    0  # Reset counter after successful reinit
-                                )
-                            except Exception as e:
-                                logger.error(
-                                    f"Camera reinitialization failed: {str(e)}"
-                                )
-                                return False
+                        if cadence.exhausted:
+                            logger.info(f"Frame budget of {cadence.frame_budget} spent")
+                            break
+                        seconds_left = (end_time - current_time).total_seconds()
+                        time.sleep(cadence.next_interval(seconds_left))
+                        continue
                 else:
                     logger.info("Waiting for the right time to capture images...")
+                    # Don't oversleep the start of the window
+                    seconds_to_start = (start_time - current_time).total_seconds()
+                    time.sleep(max(0, min(frequency, seconds_to_start)))
+                    continue
 
                 time.sleep(frequency)
 
             logger.info(
                 f"Image capture completed. Successful: {successful_captures}, Failed: {failed_captures}"
             )
+            if dedup:
+                stats = dedup.stats()
+                logger.info(
+                    f"Near-duplicates skipped: {stats['skipped']} of "
+                    f"{stats['checked']} frames"
+                )
 
         except Exception as e:
             logger.error(f"Fatal error during image capture: {str(e)}")
@@ -165,11 +265,6 @@ def capture_images(
         finally:
             # Always clean up camera resources
             if camera:
-                try:
-                    camera.stop()
-                    camera.close()
-                    logger.info("Camera resources cleaned up")
-                except Exception as e:
-                    logger.error(f"Error cleaning up camera: {str(e)}")
+                camera.close()
 
     return True
@@ -0,0 +1,125 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+DIR = Path(__file__).parent.resolve()
+
+# Upper bounds, in seconds, of the per-image latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is the process high-water mark, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Metrics:
+    """
+    Collects per-stage timings, bytes moved, the process's peak memory and
+    latency histograms for one run of the pipeline.
+
+    Stages are timed with `with metrics.stage("decode", nbytes=...)`. A stage
+    entered many times (one decode per image) accumulates a count, total and
+    max duration. Memory is only reported for the whole process: ru_maxrss
+    is a high-water mark, so read at the end of a stage it would show the
+    largest stage so far rather than that stage's own peak. Use
+    benchmarks/pipeline.py for per-stage peaks. Safe to use from the scoring
+    threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.histograms = {}
+            self.resources = []
+
+    @contextmanager
+    def stage(self, name: str, nbytes: int = 0):
+        """
+        Time a block of work as one occurrence of a stage.
+
+        :param name: Stage name, e.g. 'capture', 'decode', 'upload'
+        :param nbytes: Bytes read or written by this occurrence
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, nbytes)
+
+    def record(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(
+                name,
+                {
+                    "count": 0,
+                    "total_s": 0.0,
+                    "max_s": 0.0,
+                    "bytes": 0,
+                },
+            )
+            stage["count"] += 1
+            stage["total_s"] += seconds
+            stage["max_s"] = max(stage["max_s"], seconds)
+            stage["bytes"] += nbytes
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Add one latency sample to a histogram.
+        """
+        with self._lock:
+            counts = self.histograms.setdefault(name, [0] * len(LATENCY_BUCKETS))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+
+    def record_resources(self, **readings) -> None:
+        """
+        Add a timestamped system resource reading, e.g. memory and disk usage.
+        """
+        with self._lock:
+            self.resources.append({"time": time.time(), **readings})
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed_s": round(time.time() - self.started, 3),
+                "peak_rss_mb": round(_peak_rss_mb(), 1),
+                "stages": {
+                    name: {**stage, "total_s": round(stage["total_s"], 4)}
+                    for name, stage in self.stages.items()
+                },
+                "histograms": {
+                    name: {
+                        "buckets_s": [str(b) for b in LATENCY_BUCKETS],
+                        "counts": list(counts),
+                    }
+                    for name, counts in self.histograms.items()
+                },
+                "resources": list(self.resources),
+            }
+
+    def write(self, path: Path = DIR / "tmp" / "metrics.json") -> None:
+        """
+        Write the current metrics as a JSON file other tools can poll.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -1,27 +1,46 @@
-import schedule
+import json
 import time
 from datetime import timedelta, datetime
 import os
 from pathlib import Path
 
-from SunsetDetector import SunsetDetector
-from image_capture import capture_images
+from cadence import AdaptiveCadence
+from score_cache import ScoreCache
+from storage import StorageManager
 from logger import logger
+from metrics import metrics
 from utils import (
     determine_start_end_time,
-    tmp_cleanup,
-    find_sunset_time,
     check_system_resources,
 )
 
 DIR = Path(__file__).parent.resolve()
+STATE_FILE = DIR / "tmp" / "last_run.json"
+
+# Wake this long before the capture window to set up the camera
+LEAD_TIME = timedelta(minutes=3)
+# Longest single sleep, so wall-clock jumps are noticed within this many seconds
+MAX_SLEEP = 600
+# Most differing dHash bits, out of 64, for a frame to count as a near-duplicate
+DEDUP_THRESHOLD = 4
 
 
 def run(take_image: bool = True, testing: bool = False) -> bool:
     """
     Main function to run the sunset detection and image capture process.
     """
+    # Imported here, not at startup, so the scheduler sleeps between windows
+    # without PIL, NumPy, boto3 or the camera stack loaded
+    from SunsetDetector import SunsetDetector
+    from image_capture import capture_images
+    from camera_session import CameraSession
+    from sky_roi import get_sky_roi, history_frames
+    from feature_store import FeatureStore
+    from dedup import DuplicateFilter
+    from score_store import rebuild_if_stale
+
     logger.info("Running thesunset")
+    metrics.reset()
     start_time, sunset, end_time = determine_start_end_time(when="today")
 
     logger.info(
@@ -36,21 +55,71 @@ def run(take_image: bool = True, testing: bool = False) -> bool:
         end_time = start_time + timedelta(minutes=2)
         logger.info(f"Testing mode: Taking pictures from {start_time} to {end_time}")
 
+    day = start_time.strftime("%Y-%m-%d")
+    session = CameraSession(source="rpi")
+    # Shared by capture and scoring, near-duplicate frames are neither
+    # archived nor scored
+    dedup = DuplicateFilter(threshold=DEDUP_THRESHOLD)
+
+    try:
+        # Stored per camera configuration; learned from earlier evenings the
+        # first time this configuration runs without one
+        sky_roi = get_sky_roi(
+            session.key, history=history_frames(DIR / "tmp", before_day=day)
+        )
+        # Created up front so frames are scored as they are captured
+        detector = SunsetDetector(
+            images=str(DIR / "tmp" / day),
+            workers=os.cpu_count() or 1,
+            score_cache=ScoreCache(),
+            sky_roi=sky_roi,
+            feature_store=FeatureStore(),
+            dedup=dedup,
+        )
+    except Exception as e:
+        logger.error(f"Failed to create SunsetDetector: {str(e)}")
+        return False
+
+    storage = StorageManager(root=DIR / "tmp")
+
     if take_image:
+        if not storage.reserve():
+            logger.error("Not enough free disk space to start capturing")
+            return False
+
+        # We wake LEAD_TIME before the window, so warm up and self-test the
+        # camera now rather than at start_time. If this fails,
+        # capture_images tries again when capture starts
+        try:
+            session.open()
+        except Exception as e:
+            logger.error(f"Camera pre-warm failed: {str(e)}")
+
         logger.info("Taking pictures")
         if not os.path.exists(DIR / "tmp"):
             os.makedirs(DIR / "tmp")
-        capture_images(
-            source="rpi",
-            frequency=31 if testing else 300,
-            export_path=DIR / "tmp",
-            start_time=start_time,
-            end_time=end_time,
-        )
+        with metrics.stage("capture_window"):
+            capture_images(
+                source="rpi",
+                frequency=31 if testing else 300,
+                export_path=DIR / "tmp",
+                start_time=start_time,
+                end_time=end_time,
+                on_frame=detector.add_frame,
+                archive_every=1 if testing else 3,
+                cadence=AdaptiveCadence(
+                    min_interval=10 if testing else 60,
+                    max_interval=31 if testing else 300,
+                    frame_budget=30,
+                ),
+                score_lookup=detector.scores.get,
+                storage=storage,
+                session=session,
+                dedup=dedup,
+            )
 
-    day = start_time.strftime("%Y-%m-%d")
     logger.info(
-        f"Finished taking pictures, running SunsetDetector on images in {DIR / 'tmp' / day}"
+        f"Finished taking pictures, finalizing SunsetDetector on images in {DIR / 'tmp' / day}"
     )
 
     logger.info("Checking system resources before running SunsetDetector...")
@@ -59,7 +128,6 @@ def run(take_image: bool = True, testing: bool = False) -> bool:
         return False
 
     try:
-        detector = SunsetDetector(images=str(DIR / "tmp" / day))
         detector.run()
     except MemoryError:
         logger.error("Out of memory when running SunsetDetector")
@@ -68,77 +136,175 @@ def run(take_image: bool = True, testing: bool = False) -> bool:
         logger.error(f"SunsetDetector failed: {str(e)}")
         return False
 
-    # Clean up temporary files
-    # if not testing:
-    #     logger.info("Cleaning up temporary files")
-    #     tmp_cleanup(tmp_dir=DIR / "tmp/")
-    #     logger.info("Temporary files cleaned up.")
+    # The run only published its month shard, rebuild the aggregate once the
+    # web app would otherwise have to fetch several shards on top of it
+    rebuild_if_stale()
+
+    # Archive today's raw frames, and those of earlier days whose archive
+    # failed, then evict uploaded ones over the quota. An S3 outage must not
+    # fail the run: frames that weren't uploaded are kept for the next one
+    try:
+        for pending in sorted(set(storage.pending_days()) | {day}):
+            report = storage.archive(pending)
+            failed = [f for f, r in report.items() if r["status"] == "failed"]
+            if failed:
+                logger.warning(
+                    f"{len(failed)} frames of {pending} not archived, "
+                    f"retrying on the next run"
+                )
+        storage.scan()
+        if not storage.enforce():
+            logger.warning(f"Capture directory still over its quota: {storage}")
+    except Exception as e:
+        logger.error(f"Archiving failed, retrying on the next run: {str(e)}")
+
+    return True
 
-    schedule_next_run()
 
+class Clock:
+    """
+    Wall-clock time and sleeping, injectable so scheduling can be tested.
+    """
 
-def schedule_next_run(testing: bool = False) -> bool:
+    def now(self) -> datetime:
+        return datetime.now().astimezone()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class FakeClock(Clock):
     """
-    Schedule the next run of the sunset detection process.
+    A clock that only moves when slept on, for testing the scheduler.
     """
 
-    if testing:
-        logger.info("testing. scheduling run for 5 seconds")
-        schedule.clear()
-        schedule.every(5).seconds.do(run)
-        return True
+    def __init__(self, start: datetime):
+        self.current = start
 
-    sunset = find_sunset_time()
+    def now(self) -> datetime:
+        return self.current
 
-    if datetime.now(tz=datetime.now().astimezone().tzinfo) > sunset:
-        logger.info("Sunset has already passed for today. Scheduling for tomorrow.")
-        when = "tomorrow"
-    else:
-        when = "today"
-    logger.info(f"Scheduling next run for {when}")
+    def sleep(self, seconds: float) -> None:
+        self.current += timedelta(seconds=seconds)
 
-    start_time, sunset, end_time = determine_start_end_time(when=when)
-    logger.info(
-        f"The sunset tomorrow is at {sunset}. Taking pictures from {start_time} to {end_time}"
-    )
-    schedule.clear()
-
-    # # if > 15 minutes before start time, set fundction to reboot 15 minutes before start time
-    # if datetime.now(tz=datetime.now().astimezone().tzinfo) < start_time - timedelta(
-    #     minutes=15
-    # ):
-    #     reboot_time = (start_time - timedelta(minutes=15)).strftime("%H:%M")
-    #     logger.info(f"Scheduling system reboot at {reboot_time}")
-    #     os.system(f"echo 'sudo reboot' | at {reboot_time}")
-
-    schedule.every().day.at((start_time - timedelta(minutes=3)).strftime("%H:%M")).do(
-        run, testing=testing
-    )
-    logger.info(
-        f"Scheduled next run at {(start_time - timedelta(minutes=1)).strftime('%H:%M')}"
-    )
 
+def load_last_run() -> str:
+    """
+    Day ("%Y-%m-%d") of the last completed run, or None.
+    """
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f).get("day")
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_last_run(day: str) -> None:
+    os.makedirs(STATE_FILE.parent, exist_ok=True)
+    with open(STATE_FILE, "w") as f:
+        json.dump({"day": day}, f)
+
+
+def next_window(clock: Clock) -> tuple:
+    """
+    Find the next capture window that has not ended yet.
+
+    :return: Tuple of (wake_time, start_time, sunset, end_time), where
+        wake_time is LEAD_TIME before start_time
+    """
+    now = clock.now()
+    start_time, sunset, end_time = determine_start_end_time(when="today", now=now)
+    if now >= end_time:
+        start_time, sunset, end_time = determine_start_end_time(
+            when="tomorrow", now=now
+        )
+    return start_time - LEAD_TIME, start_time, sunset, end_time
+
+
+def sleep_until(target: datetime, clock: Clock) -> None:
+    """
+    Sleep until `target`, waking at least every MAX_SLEEP seconds.
+
+    Times are timezone-aware, so DST changes need no special handling. The
+    periodic wake-ups re-read the wall clock, so a clock step (e.g. NTP
+    syncing after a reboot) shortens or lengthens the remaining sleep.
+    """
+    while True:
+        remaining = (target - clock.now()).total_seconds()
+        if remaining <= 0:
+            return
+        clock.sleep(min(remaining, MAX_SLEEP))
+
+
+def recover_missed_window(clock: Clock, run_fn=None) -> bool:
+    """
+    Finish today's run if the window already ended without completing,
+    e.g. after a reboot mid-window or during post-processing.
+
+    Only detection and upload are redone, on whatever frames were captured.
+
+    :return: True if a recovery run was made
+    """
+    now = clock.now()
+    start_time, sunset, end_time = determine_start_end_time(when="today", now=now)
+    day = start_time.strftime("%Y-%m-%d")
+
+    if now < end_time or load_last_run() == day:
+        return False
+    if not os.path.isdir(DIR / "tmp" / day):
+        return False
+
+    logger.info(f"Recovering missed run for {day} from captured images")
+    if (run_fn or run)(take_image=False):
+        save_last_run(day)
     return True
 
 
-def main(testing: bool = False) -> None:
+def main(
+    testing: bool = False, clock: Clock = None, run_fn=None, max_runs: int = None
+) -> None:
     """
     Main entry point for the sunset detection application.
 
+    Sleeps until just before each capture window instead of polling, runs
+    it, and repeats. A window in progress at startup is joined immediately.
+
+    :param clock: Time source, a FakeClock in tests
+    :param run_fn: Function run for each window, defaults to run
+    :param max_runs: Stop after this many runs (None = forever)
     """
+    clock = clock or Clock()
+    run_fn = run_fn or run
 
     if testing:
         # Run immediately for testing purposes
         logger.info("Running thesunset immediately for testing")
-        schedule_next_run(testing=True)
-    else:
-        schedule_next_run()
+        run_fn(testing=True)
+        return
 
-    while True:
-        logger.info("Checking for scheduled runs...")
-        if schedule.run_pending():
-            logger.info("Scheduled run executed")
-        time.sleep(60)
+    recover_missed_window(clock, run_fn)
+
+    runs = 0
+    while max_runs is None or runs < max_runs:
+        wake_time, start_time, sunset, end_time = next_window(clock)
+        day = start_time.strftime("%Y-%m-%d")
+
+        if load_last_run() == day:
+            # Already done today, wait for tomorrow's window
+            sleep_until(end_time + timedelta(seconds=1), clock)
+            continue
+
+        logger.info(
+            f"Next sunset at {sunset}. Taking pictures from {start_time} to {end_time}, waking at {wake_time}"
+        )
+        sleep_until(wake_time, clock)
+
+        if run_fn():
+            save_last_run(day)
+        runs += 1
+
+        # A failed run may return early, don't retry it until the window is over
+        sleep_until(end_time + timedelta(seconds=1), clock)
 
 
 if __name__ == "__main__":
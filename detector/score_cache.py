@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from logger import logger
+
+DIR = Path(__file__).parent.resolve()
+
+
+class ScoreCache:
+    """
+    A persistent cache of per-image scores, stored as JSON next to the captures.
+
+    Entries are keyed by detector method, scorer version, analysis scale (plus
+    the sky ROI id when frames are cropped) and absolute image path, and are
+    only reused while the file's size and mtime (or, with content_hash, its
+    SHA-1) still match. The cache lives in tmp/ so it is deleted along with
+    the captures, and entries for images that no longer exist are evicted on
+    every save.
+    """
+
+    def __init__(
+        self,
+        path: Path = DIR / "tmp" / "score_cache.json",
+        content_hash: bool = False,
+        max_entries: int = 20000,
+    ):
+        self.path = Path(path)
+        self.content_hash = content_hash
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ScoreCache({self.path}, entries={len(self._load())})"
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = {}
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable score cache {self.path}: {e}")
+                self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def key(image: Path, method: str, version: int, scale: int, roi: str = None) -> str:
+        region = f"@{roi}" if roi else ""
+        return f"{method}:v{version}:s{scale}{region}:{Path(image).resolve()}"
+
+    def _fingerprint(self, image: Path) -> dict:
+        stat = os.stat(image)
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if self.content_hash:
+            with open(image, "rb") as f:
+                fingerprint["sha1"] = hashlib.file_digest(f, "sha1").hexdigest()
+        return fingerprint
+
+    def get(
+        self, image: Path, method: str, version: int, scale: int, roi: str = None
+    ) -> float:
+        """
+        Look up a cached score.
+
+        :return: The score, or None if missing or the file has changed
+        """
+        try:
+            fingerprint = self._fingerprint(image)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._load().get(self.key(image, method, version, scale, roi))
+        if entry and entry["fingerprint"] == fingerprint:
+            return entry["score"]
+        return None
+
+    def put(
+        self,
+        image: Path,
+        method: str,
+        version: int,
+        scale: int,
+        score: float,
+        roi: str = None,
+    ) -> None:
+        """
+        Record a score for the current contents of an image.
+        """
+        try:
+            fingerprint = self._fingerprint(image)
+        except OSError:
+            return
+
+        with self._lock:
+            self._load()[self.key(image, method, version, scale, roi)] = {
+                "fingerprint": fingerprint,
+                "score": float(score),
+            }
+            self._dirty = True
+
+    def evict(self) -> int:
+        """
+        Drop entries whose image no longer exists, then the oldest entries
+        beyond max_entries.
+
+        :return: Number of entries removed
+        """
+        with self._lock:
+            entries = self._load()
+            before = len(entries)
+            for key in list(entries):
+                if not os.path.exists(key.split(":", 3)[3]):
+                    del entries[key]
+
+            if len(entries) > self.max_entries:
+                oldest = sorted(
+                    entries, key=lambda k: entries[k]["fingerprint"]["mtime_ns"]
+                )
+                for key in oldest[: len(entries) - self.max_entries]:
+                    del entries[key]
+
+            removed = before - len(entries)
+            if removed:
+                self._dirty = True
+        return removed
+
+    def save(self) -> bool:
+        """
+        Evict stale entries and write the cache to disk atomically.
+
+        :return: True if successful, False otherwise
+        """
+        removed = self.evict()
+        if removed:
+            logger.info(f"Evicted {removed} stale score cache entries")
+
+        with self._lock:
+            if not self._dirty:
+                return True
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(".json.tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+                return True
+            except Exception as e:
+                logger.error(f"Error saving score cache: {e}")
+                return False
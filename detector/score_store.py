@@ -0,0 +1,341 @@
+"""
+Sharded storage for the historical scores published to S3.
+
+Days are stored in per-month shards (scores/2025-07.json) with a small index
+(scores/index.json) listing each shard's ETag and day count. Writes are
+conditional on the ETag that was read (or on the object not existing yet) and
+are retried on conflict, so concurrent writers never silently overwrite each
+other's days.
+
+The shards are the source of truth: a run only rewrites its day's shard and
+the index, so its cost does not grow with history. The aggregate scores.json,
+and the gzip-compressed, columnar scores.compact.json holding only what the
+web app renders, are derived from the shards by rebuild_aggregate, which
+records in the index the shard ETags it was built from. The web app loads
+the compact file and overlays the shards that changed since, so the
+aggregate only needs rebuilding when those pile up (rebuild_if_stale).
+
+    python score_store.py rebuild
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+
+from botocore.exceptions import ClientError
+
+from logger import logger
+from utils import get_s3_client
+
+BUCKET = "thesunset"
+AGGREGATE_KEY = "scores.json"
+COMPACT_KEY = "scores.compact.json"
+INDEX_KEY = "scores/index.json"
+SHARD_PREFIX = "scores/"
+
+# S3 answers a failed If-Match / If-None-Match with one of these codes
+CONFLICT_CODES = {"PreconditionFailed", "ConditionalRequestConflict", "412", "409"}
+# Shards that may change after the aggregate was built before it is rebuilt.
+# With one run a day only the current month's shard changes, so this rebuilds
+# about once a month
+MAX_STALE_SHARDS = 1
+
+
+class WriteConflict(Exception):
+    """Raised when a conditional write keeps losing to concurrent writers."""
+
+
+def shard_key(day: str) -> str:
+    """
+    S3 key of the month shard holding a day, e.g. scores/2025-07.json.
+    """
+    return f"{SHARD_PREFIX}{day[:7]}.json"
+
+
+def read_json(key: str, bucket: str = BUCKET) -> tuple:
+    """
+    Read a JSON object from S3.
+
+    :return: Tuple of (data, etag). Missing objects give ({}, None)
+    """
+    try:
+        response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {}, None
+        raise
+    return json.loads(response["Body"].read()), response["ETag"]
+
+
+def put_json(
+    key: str, data: dict, etag: str = None, bucket: str = BUCKET, **extra
+) -> str:
+    """
+    Write compact JSON to S3, only if the object still has the given ETag.
+
+    :param etag: ETag from the last read, or None to require that the object
+        does not exist yet
+    :return: The new ETag, or None if another writer got there first
+    """
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        response = get_s3_client().put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(data, separators=(",", ":")).encode(),
+            ContentType="application/json",
+            **condition,
+            **extra,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in CONFLICT_CODES:
+            return None
+        raise
+    return response["ETag"]
+
+
+def update_json(
+    key: str, mutate, bucket: str = BUCKET, max_attempts: int = 5, **extra
+) -> tuple:
+    """
+    Apply `mutate` to a JSON object in S3 with optimistic concurrency.
+
+    The object is re-read and `mutate` re-applied whenever the conditional
+    write loses a race.
+
+    :param mutate: Function that updates the loaded dict in place
+    :return: Tuple of (data, etag) as written
+    """
+    for attempt in range(max_attempts):
+        data, etag = read_json(key, bucket)
+        mutate(data)
+        new_etag = put_json(key, data, etag, bucket, **extra)
+        if new_etag:
+            return data, new_etag
+
+        logger.warning(f"Concurrent update of {key}, retrying ({attempt + 1})")
+        time.sleep(0.2 * 2**attempt)
+
+    raise WriteConflict(f"Gave up updating {key} after {max_attempts} attempts")
+
+
+def _seed_shards(bucket: str) -> None:
+    """
+    Split an existing aggregate scores.json into month shards.
+
+    Runs once, the first time the sharded layout is used on a bucket.
+    """
+    aggregate, _ = read_json(AGGREGATE_KEY, bucket)
+    if not aggregate:
+        return
+
+    logger.info(f"Seeding score shards from {len(aggregate)} days in {AGGREGATE_KEY}")
+    by_shard = {}
+    for day, entry in aggregate.items():
+        by_shard.setdefault(shard_key(day), {})[day] = entry
+    # The existing aggregate holds exactly these days, so it is up to date
+    _record_aggregate(write_shards(by_shard, bucket), bucket)
+
+
+def _timestamp() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def write_shards(by_shard: dict, bucket: str) -> dict:
+    """
+    Merge days into their month shards, then record the shards in the index.
+
+    :param by_shard: Dict of shard key -> {day: entry}
+    :return: Dict of shard key -> ETag as written
+    """
+    shard_etags = {}
+    shard_info = {}
+    for key, days in by_shard.items():
+        data, etag = update_json(key, lambda shard: shard.update(days), bucket)
+        shard_etags[key] = etag
+        shard_info[key] = {"etag": etag, "days": len(data)}
+
+    def record(index: dict) -> None:
+        index.setdefault("shards", {}).update(shard_info)
+        index["updated"] = _timestamp()
+
+    update_json(INDEX_KEY, record, bucket)
+    return shard_etags
+
+
+def _record_aggregate(shard_etags: dict, bucket: str) -> None:
+    """
+    Note in the index which shard versions the aggregate was built from.
+    """
+
+    def record(index: dict) -> None:
+        index["aggregate"] = {"updated": _timestamp(), "shards": shard_etags}
+
+    update_json(INDEX_KEY, record, bucket)
+
+
+def stale_shards(index: dict) -> list:
+    """
+    Shards that changed after the aggregate was last built.
+
+    :param index: The scores/index.json contents
+    :return: Sorted shard keys, the ones the web app fetches on top of the
+        compact aggregate
+    """
+    built = index.get("aggregate", {}).get("shards", {})
+    return sorted(
+        key
+        for key, shard in index.get("shards", {}).items()
+        if built.get(key) != shard["etag"]
+    )
+
+
+def compact_scores(aggregate: dict) -> dict:
+    """
+    Convert the aggregate into a columnar layout without repeated keys.
+
+    Days are sorted and every per-day field becomes one array. Each day's
+    scores become two aligned rows, its sorted time offsets (minutes from
+    sunset) and the scores at those offsets. Offsets are per day because
+    the capture cadence varies, so days rarely share them. Scores are
+    rounded to two decimals, which is all the charts show.
+
+    :param aggregate: The scores.json contents
+    :return: Dict ready to serialize
+    """
+    days = sorted(aggregate)
+
+    def points(entry: dict) -> list:
+        return sorted(
+            (float(k), round(v, 2)) for k, v in entry.get("scores", {}).items()
+        )
+
+    rows = [points(aggregate[d]) for d in days]
+    return {
+        "version": 2,
+        "days": days,
+        "max_score": [round(aggregate[d].get("max_score", 0.0), 2) for d in days],
+        "best_image_time": [aggregate[d].get("best_image_time") for d in days],
+        "min_to_sunset": [aggregate[d].get("min_to_sunset") for d in days],
+        "offsets": [[int(o) if o.is_integer() else o for o, _ in r] for r in rows],
+        "scores": [[v for _, v in r] for r in rows],
+    }
+
+
+def publish_compact(aggregate: dict, bucket: str = BUCKET) -> bool:
+    """
+    Upload the gzip-precompressed compact aggregate for the web app.
+
+    Stored with Content-Encoding: gzip so browsers decompress it
+    transparently. It is derived data, so it is written unconditionally.
+
+    :return: True if successful, False otherwise
+    """
+    body = gzip.compress(
+        json.dumps(compact_scores(aggregate), separators=(",", ":")).encode(),
+        mtime=0,
+    )
+    try:
+        get_s3_client().put_object(
+            Bucket=bucket,
+            Key=COMPACT_KEY,
+            Body=body,
+            ContentType="application/json",
+            ContentEncoding="gzip",
+            CacheControl="max-age=300",
+        )
+        logger.info(f"Published {COMPACT_KEY} ({len(body)} bytes gzipped)")
+        return True
+    except Exception as e:
+        logger.error(f"Error publishing {COMPACT_KEY}: {e}")
+        return False
+
+
+def write_day_scores(entries: dict, bucket: str = BUCKET) -> bool:
+    """
+    Publish scores for one or more days.
+
+    Only the month shards holding those days and the index are updated. The
+    aggregate is left to rebuild_aggregate, and the web app picks the days
+    up from the shards until then.
+
+    :param entries: Dict of day ("%Y-%m-%d") -> scores entry
+    :return: True if successful, False otherwise
+    """
+    try:
+        _, index_etag = read_json(INDEX_KEY, bucket)
+        if index_etag is None:
+            _seed_shards(bucket)
+
+        by_shard = {}
+        for day, entry in entries.items():
+            by_shard.setdefault(shard_key(day), {})[day] = entry
+        write_shards(by_shard, bucket)
+
+        logger.info(f"Published scores for {len(entries)} day(s) to {bucket}")
+        return True
+    except Exception as e:
+        logger.error(f"Error publishing scores: {e}")
+        return False
+
+
+def rebuild_aggregate(bucket: str = BUCKET) -> dict:
+    """
+    Regenerate scores.json and scores.compact.json from the shards.
+
+    Every shard is read, so this costs more as history grows. The shard ETags
+    read are recorded in the index, so a shard written meanwhile shows up as
+    stale rather than being lost.
+
+    :return: The rebuilt aggregate
+    """
+    index, _ = read_json(INDEX_KEY, bucket)
+    aggregate = {}
+    shard_etags = {}
+    for key in sorted(index.get("shards", {})):
+        shard, shard_etags[key] = read_json(key, bucket)
+        aggregate.update(shard)
+
+    _, etag = read_json(AGGREGATE_KEY, bucket)
+    if not put_json(AGGREGATE_KEY, aggregate, etag, bucket, CacheControl="max-age=300"):
+        raise WriteConflict(f"{AGGREGATE_KEY} changed while rebuilding it")
+    publish_compact(aggregate, bucket)
+    _record_aggregate(shard_etags, bucket)
+    logger.info(f"Rebuilt {AGGREGATE_KEY} from {len(shard_etags)} shards")
+    return aggregate
+
+
+def rebuild_if_stale(bucket: str = BUCKET, max_stale: int = MAX_STALE_SHARDS) -> bool:
+    """
+    Rebuild the aggregate once more than max_stale shards changed since.
+
+    :return: True if the aggregate is up to date enough or was rebuilt, False
+        if rebuilding failed
+    """
+    try:
+        index, _ = read_json(INDEX_KEY, bucket)
+        stale = stale_shards(index)
+        if len(stale) <= max_stale:
+            return True
+        logger.info(f"Rebuilding {AGGREGATE_KEY}, {len(stale)} shards changed since")
+        rebuild_aggregate(bucket)
+        return True
+    except Exception as e:
+        logger.error(f"Error rebuilding {AGGREGATE_KEY}: {e}")
+        return False
+
+
+def main(args) -> int:
+    aggregate = rebuild_aggregate(args.bucket)
+    print(f"Rebuilt {AGGREGATE_KEY} with {len(aggregate)} days")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bucket", default=BUCKET)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="Rebuild the aggregate from the shards")
+    sys.exit(main(parser.parse_args()))
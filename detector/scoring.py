@@ -0,0 +1,274 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ANALYSIS_SCALES = (1, 2, 4, 8)
+
+# name -> Scorer, filled in by @register_scorer
+SCORERS = {}
+SCORER_ALIASES = {}
+
+
+def crop_box(box: tuple, size: tuple) -> tuple:
+    """
+    Convert a box given as fractions of the frame into pixels.
+
+    :param box: (left, top, right, bottom) as fractions of width and height
+    :param size: Frame (width, height)
+    :return: (left, top, right, bottom) in pixels, at least one pixel wide
+    """
+    width, height = size
+    left, top = int(box[0] * width), int(box[1] * height)
+    return (
+        left,
+        top,
+        max(left + 1, round(box[2] * width)),
+        max(top + 1, round(box[3] * height)),
+    )
+
+
+def load_rgb_array(image: Path, scale: int = 1, box: tuple = None) -> np.ndarray:
+    """
+    Decode an image into a single (height, width, 3) uint8 RGB array.
+
+    With a scale above 1 the frame is decoded directly at reduced size: JPEGs
+    use PIL's draft mode so libjpeg performs the 1/2, 1/4 or 1/8 DCT scaling
+    itself, and any remaining factor (or a non-JPEG source) is box-reduced.
+
+    :param image: Path to the image file
+    :param scale: Linear downscale factor, one of ANALYSIS_SCALES
+    :param box: Optional crop as fractions of the frame, applied before the
+        RGB conversion so only the cropped pixels are converted
+    :return: The decoded pixels
+    """
+    if scale not in ANALYSIS_SCALES:
+        raise ValueError(f"Analysis scale must be one of {ANALYSIS_SCALES}")
+
+    with Image.open(image) as img:
+        if scale > 1:
+            target = (max(1, img.width // scale), max(1, img.height // scale))
+            img.draft("RGB", target)
+            factor = img.width // target[0]
+            if factor > 1:
+                img = img.reduce(factor)
+        if box is not None:
+            img = img.crop(crop_box(box, img.size))
+        return np.asarray(img.convert("RGB"))
+
+
+def channel_means(pixels: np.ndarray) -> tuple:
+    """
+    Average R, G and B values over every pixel in one vectorized pass.
+
+    The channel sums are accumulated as exact integers and divided once, so the
+    result matches summing each pixel tuple in Python.
+
+    :param pixels: Array of RGB pixels, any shape ending in 3
+    :return: Tuple of (average_r, average_g, average_b)
+    """
+    flat = pixels.reshape(-1, 3)
+    count = flat.shape[0]
+    if count == 0:
+        return (0.0, 0.0, 0.0)
+
+    totals = flat.sum(axis=0, dtype=np.uint64)
+    return tuple(int(total) / count for total in totals)
+
+
+def laplacian_variance(pixels: np.ndarray) -> float:
+    """
+    Sharpness of a frame as the variance of the Laplacian of its luma.
+
+    Blurred frames (camera shake, condensation, autofocus hunting) have
+    little high-frequency detail and score low. Values depend on the scale
+    the frame was decoded at, so only compare frames at the same scale.
+
+    :param pixels: (height, width, 3) uint8 RGB array
+    :return: Variance of the 4-neighbor Laplacian
+    """
+    if pixels.ndim != 3 or min(pixels.shape[:2]) < 3:
+        return 0.0
+    luma = pixels.astype(np.float32) @ np.array([0.299, 0.587, 0.114], np.float32)
+    laplacian = (
+        luma[:-2, 1:-1]
+        + luma[2:, 1:-1]
+        + luma[1:-1, :-2]
+        + luma[1:-1, 2:]
+        - 4 * luma[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def rank_correlation(first: list, second: list) -> float:
+    """
+    Spearman correlation between two rankings of the same items.
+
+    :param first: Items in the first ranking's order
+    :param second: The same items in the second ranking's order
+    :return: 1.0 for identical rankings, -1.0 for reversed ones
+    """
+    n = len(first)
+    if n < 2:
+        return 1.0
+    position = {item: i for i, item in enumerate(second)}
+    squared = sum((i - position[item]) ** 2 for i, item in enumerate(first))
+    return 1 - 6 * squared / (n * (n * n - 1))
+
+
+def reduce_array(pixels: np.ndarray, scale: int = 1) -> np.ndarray:
+    """
+    Box-reduce an in-memory RGB frame, matching load_rgb_array's scaling.
+
+    :param pixels: (height, width, 3) uint8 RGB array
+    :param scale: Linear downscale factor, one of ANALYSIS_SCALES
+    :return: The reduced pixels
+    """
+    if scale not in ANALYSIS_SCALES:
+        raise ValueError(f"Analysis scale must be one of {ANALYSIS_SCALES}")
+    if scale == 1:
+        return pixels
+    return np.asarray(Image.fromarray(pixels).reduce(scale))
+
+
+class Frame:
+    """
+    One decoded frame shared by every scorer, with derived views computed on
+    first use so a multi-scorer pass converts to HSV at most once.
+    """
+
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels
+        self.flat = pixels.reshape(-1, 3)
+        self._hsv = None
+
+    @property
+    def hsv(self) -> tuple:
+        """
+        (hue, saturation, value) arrays on OpenCV's 8-bit scales.
+        """
+        if self._hsv is None:
+            self._hsv = rgb_to_hsv(self.flat)
+        return self._hsv
+
+
+class Scorer:
+    """
+    A registered scoring function with the version of its implementation.
+
+    Bump a scorer's version whenever its scores change, so cached scores are
+    not reused across incompatible implementations.
+    """
+
+    def __init__(self, name: str, version: int, func):
+        self.name = name
+        self.version = version
+        self.func = func
+
+    def __call__(self, frame: Frame) -> float:
+        return float(self.func(frame))
+
+    def __repr__(self):
+        return f"Scorer({self.name}, v{self.version})"
+
+
+def register_scorer(name: str, version: int = 1, aliases: tuple = ()):
+    """
+    Decorator registering a function of a Frame as a named scorer.
+
+    :param name: Name used as SunsetDetector's detect_method
+    :param version: Implementation version, part of the score cache key
+    :param aliases: Other names that resolve to this scorer
+    """
+
+    def decorator(func):
+        SCORERS[name] = Scorer(name, version, func)
+        for alias in aliases:
+            SCORER_ALIASES[alias] = name
+        return func
+
+    return decorator
+
+
+def get_scorer(name: str) -> Scorer:
+    """
+    Look up a registered scorer by name or alias.
+
+    :raises ValueError: If no scorer has that name
+    """
+    scorer = SCORERS.get(SCORER_ALIASES.get(name, name))
+    if scorer is None:
+        names = sorted(SCORERS) + sorted(SCORER_ALIASES)
+        raise ValueError(f"Method must be one of {names}")
+    return scorer
+
+
+def score_frame(pixels: np.ndarray, names: list = None) -> dict:
+    """
+    Run several scorers over one decoded frame.
+
+    :param pixels: Array of RGB pixels
+    :param names: Scorer names, defaults to every registered scorer
+    :return: Dict of scorer name -> score
+    """
+    frame = Frame(pixels)
+    return {name: get_scorer(name)(frame) for name in (names or sorted(SCORERS))}
+
+
+def rgb_to_hsv(flat: np.ndarray) -> tuple:
+    """
+    Vectorized RGB to HSV with OpenCV's 8-bit ranges (H 0-180, S and V 0-255).
+
+    :param flat: (N, 3) uint8 RGB pixels
+    :return: Tuple of float32 (hue, saturation, value) arrays of length N
+    """
+    r, g, b = (flat[:, i].astype(np.float32) for i in range(3))
+    value = np.maximum(np.maximum(r, g), b)
+    delta = value - np.minimum(np.minimum(r, g), b)
+
+    saturation = np.zeros_like(value)
+    np.divide(delta * 255, value, out=saturation, where=value > 0)
+
+    safe_delta = np.where(delta > 0, delta, 1)
+    hue = np.where(
+        value == r,
+        (g - b) / safe_delta,
+        np.where(value == g, 2 + (b - r) / safe_delta, 4 + (r - g) / safe_delta),
+    )
+    hue = np.where(delta > 0, (hue * 30) % 180, 0).astype(np.float32)
+
+    return hue, saturation, value
+
+
+@register_scorer("red", version=1)
+def score_red(frame: Frame) -> float:
+    """
+    Score a frame by its average red value.
+    """
+    average_r, average_g, average_b = channel_means(frame.flat)
+    return average_r
+
+
+@register_scorer("hue", version=1, aliases=("cv2",))
+def score_sunset_hue(frame: Frame) -> float:
+    """
+    Score a frame by the fraction of vivid red, orange and yellow pixels.
+
+    Uses the hue ranges of the original OpenCV detector: H in [0, 40] or
+    [160, 180] with S and V of at least 100.
+    """
+    hue, saturation, value = frame.hsv
+    if hue.size == 0:
+        return 0.0
+    vivid = (saturation >= 100) & (value >= 100)
+    sunset_hue = (hue <= 40) | (hue >= 160)
+    return np.count_nonzero(vivid & sunset_hue) / hue.size
+
+
+@register_scorer("saturation", version=1)
+def score_saturation(frame: Frame) -> float:
+    """
+    Score a frame by its mean saturation. Higher = more vivid colors.
+    """
+    hue, saturation, value = frame.hsv
+    return float(saturation.mean()) if saturation.size else 0.0
@@ -0,0 +1,306 @@
+"""
+Sky region of interest for scoring.
+
+Only the sky matters for a sunset, so frames are cropped to the sky's
+bounding box and, where the sky is not a rectangle, masked down to sky
+pixels before scoring. The region is either configured as a polygon or
+learned from historical frames. It is stored once per camera configuration
+in cache/ as a crop box plus a small packed bitmask, and is only recomputed
+when that configuration changes.
+
+    python sky_roi.py rpi-3280x2464 --polygon "0,0 1,0 1,0.55 0.6,0.7 0,0.6"
+    python sky_roi.py rpi-3280x2464 --learn tmp/2025-07-01 tmp/2025-07-02
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from logger import logger
+from scoring import crop_box, load_rgb_array
+from storage import is_raw_frame
+
+DIR = Path(__file__).parent.resolve()
+CACHE_DIR = DIR / "cache"
+
+# The stored mask is this many cells wide, scaled to each frame's crop
+MASK_WIDTH = 128
+# Frames are analyzed at 1/LEARN_SCALE when learning the sky
+LEARN_SCALE = 8
+MIN_LEARN_FRAMES = 8
+
+
+class SkyROI:
+    """
+    A crop box and optional mask, both in coordinates relative to the frame.
+
+    :param box: (left, top, right, bottom) as fractions of width and height
+    :param mask: Boolean array covering the box, True for sky. None means the
+        whole box is sky
+    """
+
+    def __init__(self, camera_key: str, box: tuple, mask: np.ndarray = None):
+        self.camera_key = camera_key
+        self.box = tuple(float(v) for v in box)
+        self.mask = None if mask is None or mask.all() else mask.astype(bool)
+        self._masks = {}
+
+    def __repr__(self):
+        coverage = 1.0 if self.mask is None else self.mask.mean()
+        return f"SkyROI({self.camera_key}, box={self.box}, sky={coverage:.0%} of box)"
+
+    @property
+    def id(self) -> str:
+        """
+        Short hash of the region, part of the score cache key.
+        """
+        digest = hashlib.sha1(json.dumps(self.box).encode())
+        if self.mask is not None:
+            digest.update(np.packbits(self.mask).tobytes())
+        return digest.hexdigest()[:10]
+
+    def box_for(self, size: tuple) -> tuple:
+        """
+        The crop box in pixels for a frame of (width, height).
+        """
+        return crop_box(self.box, size)
+
+    def _mask_for(self, shape: tuple) -> np.ndarray:
+        # Nearest-neighbor scaled once per crop shape and reused
+        if shape not in self._masks:
+            mask = Image.fromarray(self.mask.astype(np.uint8) * 255)
+            self._masks[shape] = (
+                np.asarray(mask.resize((shape[1], shape[0]), Image.NEAREST)) > 127
+            )
+        return self._masks[shape]
+
+    def crop(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Crop a (height, width, 3) frame to the box, as a view.
+        """
+        left, top, right, bottom = self.box_for((pixels.shape[1], pixels.shape[0]))
+        return pixels[top:bottom, left:right]
+
+    def apply(self, pixels: np.ndarray, cropped: bool = False) -> np.ndarray:
+        """
+        Reduce a frame to its sky pixels.
+
+        :param pixels: (height, width, 3) frame, or its crop if cropped
+        :return: The cropped frame if there is no mask, else (N, 3) sky pixels
+        """
+        if not cropped:
+            pixels = self.crop(pixels)
+        if self.mask is None:
+            return pixels
+        return pixels[self._mask_for(pixels.shape[:2])]
+
+    def load(self, image: Path, scale: int = 1) -> np.ndarray:
+        """
+        Decode an image's sky pixels, cropping before RGB conversion.
+        """
+        return self.apply(load_rgb_array(image, scale, box=self.box), cropped=True)
+
+    def to_dict(self) -> dict:
+        data = {"camera_key": self.camera_key, "box": list(self.box), "mask": None}
+        if self.mask is not None:
+            data["mask"] = {
+                "shape": list(self.mask.shape),
+                "bits": base64.b64encode(np.packbits(self.mask)).decode(),
+            }
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SkyROI":
+        mask = None
+        if data.get("mask"):
+            shape = tuple(data["mask"]["shape"])
+            bits = np.frombuffer(base64.b64decode(data["mask"]["bits"]), np.uint8)
+            mask = np.unpackbits(bits)[: shape[0] * shape[1]].reshape(shape)
+        return cls(data["camera_key"], data["box"], mask)
+
+    @classmethod
+    def from_polygon(cls, camera_key: str, points: list) -> "SkyROI":
+        """
+        Build the region from a sky polygon.
+
+        :param points: [(x, y), ...] as fractions of frame width and height
+        """
+        xs = [min(max(x, 0.0), 1.0) for x, _ in points]
+        ys = [min(max(y, 0.0), 1.0) for _, y in points]
+        box = (min(xs), min(ys), max(xs), max(ys))
+
+        width = MASK_WIDTH
+        height = max(
+            1, round(MASK_WIDTH * (box[3] - box[1]) / max(box[2] - box[0], 1e-6))
+        )
+        canvas = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(canvas).polygon(
+            [
+                (
+                    (x - box[0]) / max(box[2] - box[0], 1e-6) * (width - 1),
+                    (y - box[1]) / max(box[3] - box[1], 1e-6) * (height - 1),
+                )
+                for x, y in zip(xs, ys)
+            ],
+            fill=255,
+        )
+        return cls(camera_key, box, np.asarray(canvas) > 127)
+
+    @classmethod
+    def learn(cls, camera_key: str, images: list, threshold: float = 0.35) -> "SkyROI":
+        """
+        Learn the sky from historical frames of one camera configuration.
+
+        Over an evening the sky's color changes far more than buildings or
+        foreground do, which mostly just get darker. Each pixel's temporal
+        spread of chromaticity is computed at reduced scale, cells spreading
+        more than threshold times the 95th percentile are taken as sky, and
+        the mask is cleaned up with a morphological opening.
+
+        :param images: Paths to frames, ideally from several evenings
+        :param threshold: Fraction of the high spread that counts as sky
+        """
+        if len(images) < MIN_LEARN_FRAMES:
+            raise ValueError(f"Need at least {MIN_LEARN_FRAMES} frames to learn")
+
+        frames = [load_rgb_array(image, LEARN_SCALE) for image in images]
+        shape = min(f.shape[:2] for f in frames)
+        stack = np.stack([f[: shape[0], : shape[1]] for f in frames]).astype(np.float32)
+        chroma = stack / (stack.sum(axis=-1, keepdims=True) + 1.0)
+        spread = chroma.std(axis=0).sum(axis=-1)
+
+        sky = spread > threshold * np.percentile(spread, 95)
+        cleaned = (
+            Image.fromarray(sky.astype(np.uint8) * 255)
+            .filter(ImageFilter.MinFilter(3))
+            .filter(ImageFilter.MaxFilter(3))
+        )
+        sky = np.asarray(cleaned) > 127
+        if not sky.any():
+            raise ValueError("No sky found in the given frames")
+
+        rows = np.flatnonzero(sky.any(axis=1))
+        cols = np.flatnonzero(sky.any(axis=0))
+        height, width = sky.shape
+        box = (
+            cols[0] / width,
+            rows[0] / height,
+            (cols[-1] + 1) / width,
+            (rows[-1] + 1) / height,
+        )
+        mask = sky[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+        return cls(camera_key, box, mask)
+
+
+def roi_path(camera_key: str) -> Path:
+    return CACHE_DIR / f"sky_roi_{camera_key}.json"
+
+
+def save_sky_roi(roi: SkyROI) -> None:
+    path = roi_path(roi.camera_key)
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(roi.to_dict(), f)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved {roi} to {path}")
+
+
+def load_sky_roi(camera_key: str) -> SkyROI:
+    """
+    The stored region for a camera configuration, or None.
+    """
+    try:
+        with open(roi_path(camera_key), "r") as f:
+            return SkyROI.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable sky ROI for {camera_key}: {e}")
+        return None
+
+
+def get_sky_roi(camera_key: str, polygon: list = None, history: list = None) -> SkyROI:
+    """
+    The sky region for a camera configuration, computed only on first use.
+
+    :param polygon: Configured sky polygon, takes precedence over learning
+    :param history: Historical frames to learn from if nothing is stored
+    :return: The region, or None to score whole frames
+    """
+    roi = load_sky_roi(camera_key)
+    if polygon:
+        configured = SkyROI.from_polygon(camera_key, polygon)
+        if roi is None or roi.id != configured.id:
+            save_sky_roi(configured)
+        return configured
+    if roi is not None:
+        return roi
+    if history and len(history) >= MIN_LEARN_FRAMES:
+        try:
+            roi = SkyROI.learn(camera_key, history)
+        except Exception as e:
+            logger.warning(f"Could not learn the sky for {camera_key}: {e}")
+            return None
+        save_sky_roi(roi)
+        return roi
+    return None
+
+
+def history_frames(root: Path, before_day: str, days: int = 3) -> list:
+    """
+    Raw frames from the most recent day folders before a given day.
+
+    :param root: Capture directory holding one folder per day
+    :param before_day: Day to exclude, and every later one, as YYYY-MM-DD
+    """
+    root = Path(root)
+    if not root.exists():
+        return []
+    folders = sorted(p for p in root.iterdir() if p.is_dir() and p.name[:1].isdigit())
+    folders = [p for p in folders if p.name < before_day][-days:]
+    return [
+        str(p)
+        for folder in folders
+        for p in sorted(folder.iterdir())
+        if is_raw_frame(p.name)
+    ]
+
+
+def parse_polygon(text: str) -> list:
+    """
+    Parse "x,y x,y ..." into [(x, y), ...].
+    """
+    return [tuple(float(v) for v in point.split(",")) for point in text.split()]
+
+
+def main(args) -> int:
+    if args.polygon:
+        roi = get_sky_roi(args.camera_key, polygon=parse_polygon(args.polygon))
+    else:
+        images = sorted(
+            str(p)
+            for folder in args.learn
+            for p in Path(folder).iterdir()
+            if is_raw_frame(p.name)
+        )
+        roi = SkyROI.learn(args.camera_key, images)
+        save_sky_roi(roi)
+    print(roi)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("camera_key", help="e.g. rpi-3280x2464")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--polygon", help='Sky polygon, e.g. "0,0 1,0 1,0.6 0,0.6"')
+    group.add_argument("--learn", nargs="+", help="Day folders to learn from")
+    sys.exit(main(parser.parse_args()))
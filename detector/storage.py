@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
+from logger import logger
+from utils import upload_folder_s3
+
+DIR = Path(__file__).parent.resolve()
+
+# Raw frames are named by capture time, e.g. 20250704_2015.jpg or 20250704_201530.jpg
+RAW_FRAME = re.compile(r"^\d{8}_\d{4}(\d{2})?\.(jpg|jpeg|png)$", re.IGNORECASE)
+
+
+def is_raw_frame(filename: str) -> bool:
+    return bool(RAW_FRAME.match(filename))
+
+
+class StorageManager:
+    """
+    Keeps the capture directory within a byte quota.
+
+    Only raw frames that have been uploaded to S3 are ever deleted, oldest
+    first, and never a day's best frame. Best image derivatives, metadata
+    and caches are kept. The directory is walked once; after that usage is
+    tracked incrementally, so reserve() is cheap enough to call before every
+    capture.
+    """
+
+    def __init__(
+        self,
+        root: Path = DIR / "tmp",
+        quota_mb: int = 2048,
+        min_free_mb: int = 500,
+        frame_mb: int = 4,
+        bucket: str = "thesunset",
+    ):
+        """
+        :param quota_mb: Most the capture directory may hold
+        :param min_free_mb: Free disk space below which capture is refused
+        :param frame_mb: Space reserved for one frame before it is captured
+        """
+        self.root = Path(root)
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self.min_free_bytes = min_free_mb * 1024 * 1024
+        self.frame_bytes = frame_mb * 1024 * 1024
+        self.bucket = bucket
+        self.manifest_path = self.root / "storage.json"
+        self._lock = threading.Lock()
+        self._best_frames = {}
+        self.uploaded = self._load_manifest()
+        self.scan()
+
+    def __repr__(self):
+        return (
+            f"StorageManager({self.used_bytes / 1024 / 1024:.0f}/"
+            f"{self.quota_bytes / 1024 / 1024:.0f} MB, {len(self.frames)} frames)"
+        )
+
+    def _load_manifest(self) -> set:
+        try:
+            with open(self.manifest_path, "r") as f:
+                return set(json.load(f)["uploaded"])
+        except FileNotFoundError:
+            return set()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable storage manifest: {e}")
+            return set()
+
+    def _save_manifest(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"uploaded": sorted(self.uploaded)}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def scan(self) -> None:
+        """
+        Walk the capture directory to total its size and list raw frames.
+        """
+        used = 0
+        frames = []
+        for folder, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(folder) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                used += stat.st_size
+                if is_raw_frame(filename):
+                    frames.append((stat.st_mtime, self._key(path), stat.st_size))
+
+        with self._lock:
+            self.used_bytes = used
+            # Oldest first, the order frames are evicted in
+            self.frames = sorted(frames)
+            self.uploaded &= {key for _, key, _ in frames}
+
+    def _key(self, path: Path) -> str:
+        return str(Path(path).resolve().relative_to(self.root.resolve()))
+
+    def track(self, path: Path) -> None:
+        """
+        Account for a file just written to the capture directory.
+        """
+        try:
+            stat = Path(path).stat()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.used_bytes += stat.st_size
+            if is_raw_frame(Path(path).name):
+                self.frames.append((stat.st_mtime, self._key(path), stat.st_size))
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.root if self.root.exists() else DIR).free
+
+    def reserve(self, nbytes: int = None) -> bool:
+        """
+        Make room for a file about to be written.
+
+        Evicts uploaded raw frames while the new file would break the quota
+        or leave less than min_free_mb on disk.
+
+        :param nbytes: Size of the file, defaults to frame_mb
+        :return: False if there still isn't min_free_mb left after it
+        """
+        nbytes = nbytes or self.frame_bytes
+        over_quota = self.used_bytes + nbytes - self.quota_bytes
+        short_of_free = self.min_free_bytes + nbytes - self.free_bytes()
+        needed = max(over_quota, short_of_free)
+        if needed > 0:
+            self.evict(needed)
+
+        if self.used_bytes + nbytes > self.quota_bytes:
+            logger.warning(
+                f"Capture directory over its quota by "
+                f"{(self.used_bytes + nbytes - self.quota_bytes) / 1024 / 1024:.0f} MB, "
+                f"nothing left that is safe to evict"
+            )
+        if self.free_bytes() - nbytes < self.min_free_bytes:
+            logger.error(
+                f"Only {self.free_bytes() / 1024 / 1024:.0f} MB free, "
+                f"below the {self.min_free_bytes / 1024 / 1024:.0f} MB threshold"
+            )
+            return False
+        return True
+
+    def _best_frame(self, day: str) -> str:
+        """
+        Filename of a day's best frame, from its metadata.json.
+        """
+        if day not in self._best_frames:
+            try:
+                with open(self.root / day / "metadata.json", "r") as f:
+                    best_image = json.load(f).get("best_image") or ""
+            except (FileNotFoundError, json.JSONDecodeError):
+                # Not written yet, look again next time
+                return None
+            self._best_frames[day] = Path(best_image).name
+        return self._best_frames[day]
+
+    def evict(self, nbytes: int) -> int:
+        """
+        Delete uploaded raw frames, oldest first, until nbytes are freed.
+
+        :return: Bytes freed
+        """
+        freed = 0
+        kept = []
+        with self._lock:
+            for i, (mtime, key, size) in enumerate(self.frames):
+                if freed >= nbytes:
+                    kept.extend(self.frames[i:])
+                    break
+
+                path = Path(key)
+                day = path.parent.name
+                if key not in self.uploaded or path.name == self._best_frame(day):
+                    kept.append((mtime, key, size))
+                    continue
+
+                try:
+                    os.remove(self.root / key)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Could not evict {key}: {e}")
+                    kept.append((mtime, key, size))
+                    continue
+                freed += size
+                self.used_bytes -= size
+                self.uploaded.discard(key)
+
+            self.frames = kept
+
+        if freed:
+            self._save_manifest()
+            logger.info(f"Evicted {freed / 1024 / 1024:.1f} MB of uploaded frames")
+        return freed
+
+    def archive(self, day: str, s3_folder: str = "images/") -> dict:
+        """
+        Upload a day's raw frames to S3 and mark them safe to evict.
+
+        :return: The upload_folder_s3 report
+        """
+        report = upload_folder_s3(
+            self.root / day,
+            s3_folder=f"{s3_folder}{day}/",
+            bucket=self.bucket,
+            include=is_raw_frame,
+        )
+        with self._lock:
+            for filename, result in report.items():
+                if result["status"] in ("uploaded", "skipped"):
+                    self.uploaded.add(self._key(self.root / day / filename))
+        self._save_manifest()
+        return report
+
+    def pending_days(self) -> list:
+        """
+        Days with raw frames that have not been uploaded yet, oldest first.
+        """
+        with self._lock:
+            days = {
+                Path(key).parent.name
+                for _, key, _ in self.frames
+                if key not in self.uploaded
+            }
+        return sorted(day for day in days if day)
+
+    def enforce(self) -> bool:
+        """
+        Evict uploaded frames until the directory is back within its quota.
+
+        :return: True if the directory is within its quota
+        """
+        if self.used_bytes > self.quota_bytes:
+            self.evict(self.used_bytes - self.quota_bytes)
+        return self.used_bytes <= self.quota_bytes
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+import pytz
+
+from logger import logger
+
+DIR = Path(__file__).parent.resolve()
+CACHE_DIR = DIR / "cache"
+
+EVENTS = ("sunset", "civil_dusk", "nautical_dusk")
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class SunTable:
+    """
+    A persisted table of sunset, civil dusk and nautical dusk times for one
+    location, one row per day.
+
+    Rows are computed with astral a year at a time and saved as JSON in
+    cache/, so lookups for any day already in the table never import astral
+    or compute solar positions.
+    """
+
+    def __init__(
+        self,
+        city_name: str,
+        region_name: str,
+        timezone_name: str,
+        latitude: float,
+        longitude: float,
+        days: int = 366,
+    ):
+        self.city_name = city_name
+        self.region_name = region_name
+        self.timezone_name = timezone_name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.days = days
+        self.tz = pytz.timezone(timezone_name)
+        self.path = CACHE_DIR / f"sun_{self.key}.json"
+        self._lock = threading.RLock()
+        self.rows = self._load()
+
+    def __repr__(self):
+        return f"SunTable({self.city_name}, {len(self.rows)} days)"
+
+    @property
+    def key(self) -> str:
+        name = self.city_name.lower().replace(" ", "_")
+        return f"{name}_{self.latitude:.4f}_{self.longitude:.4f}"
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)["rows"]
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable sun table {self.path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "location": {
+                        "city_name": self.city_name,
+                        "region_name": self.region_name,
+                        "timezone_name": self.timezone_name,
+                        "latitude": self.latitude,
+                        "longitude": self.longitude,
+                    },
+                    "rows": self.rows,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def build(self, start: date, days: int = None) -> None:
+        """
+        Compute `days` rows starting at `start` and persist the table.
+        """
+        # Only imported when the table has to be (re)computed
+        from astral import Depression, LocationInfo
+        from astral.sun import dusk, sun
+
+        days = days or self.days
+        observer = LocationInfo(
+            name=self.city_name,
+            region=self.region_name,
+            timezone=self.timezone_name,
+            latitude=self.latitude,
+            longitude=self.longitude,
+        ).observer
+
+        rows = {}
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            s = sun(observer, date=day, tzinfo=self.tz)
+            rows[day.isoformat()] = {
+                "sunset": s["sunset"].isoformat(),
+                "civil_dusk": s["dusk"].isoformat(),
+                "nautical_dusk": dusk(
+                    observer, date=day, tzinfo=self.tz, depression=Depression.NAUTICAL
+                ).isoformat(),
+            }
+
+        with self._lock:
+            self.rows.update(rows)
+            self.save()
+        logger.info(f"Computed {days} days of sun times from {start} for {self.key}")
+
+    def lookup(self, day: date, event: str = "sunset") -> datetime:
+        """
+        Time of a sun event on a day, computing rows through a year past it on a miss.
+
+        :param event: One of 'sunset', 'civil_dusk' or 'nautical_dusk'
+        :return: Timezone-aware datetime in the location's timezone
+        """
+        if event not in EVENTS:
+            raise ValueError(f"Event must be one of {EVENTS}")
+
+        row = self.rows.get(day.isoformat())
+        if row is None:
+            # Threads missing on the same day wait for one build, not one each
+            with self._lock:
+                if day.isoformat() not in self.rows:
+                    # From January 1st, so nearby misses in either direction hit
+                    start = day.replace(month=1, day=1)
+                    self.build(start, self.days + (day - start).days)
+                row = self.rows[day.isoformat()]
+        return datetime.fromisoformat(row[event]).astimezone(self.tz)
+
+
+def get_sun_table(
+    city_name: str,
+    region_name: str,
+    timezone_name: str,
+    latitude: float,
+    longitude: float,
+) -> SunTable:
+    """
+    The shared SunTable for a location, loaded from disk once per process.
+    """
+    key = (city_name, region_name, timezone_name, latitude, longitude)
+    if key not in _tables:
+        with _tables_lock:
+            if key not in _tables:
+                _tables[key] = SunTable(*key)
+    return _tables[key]
+
+
+@lru_cache(maxsize=1024)
+def sun_time(
+    city_name: str,
+    region_name: str,
+    timezone_name: str,
+    latitude: float,
+    longitude: float,
+    day: date,
+    event: str = "sunset",
+) -> datetime:
+    """
+    Memoized lookup of a sun event for a location and day.
+    """
+    table = get_sun_table(city_name, region_name, timezone_name, latitude, longitude)
+    return table.lookup(day, event)
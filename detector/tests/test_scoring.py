@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from scoring import channel_means, load_rgb_array
+
+
+def getdata_means(image) -> tuple:
+    """
+    The original scorer: three generator sums over getdata().
+    """
+    img = Image.open(image).convert("RGB")
+    colors = img.getdata()
+    average_r = sum(color[0] for color in colors) / len(colors)
+    average_g = sum(color[1] for color in colors) / len(colors)
+    average_b = sum(color[2] for color in colors) / len(colors)
+    return (average_r, average_g, average_b)
+
+
+# getdata() is deprecated in recent Pillow, but it is what is being compared against
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.parametrize(
+    "mode, suffix, channels",
+    [("RGB", "jpg", 3), ("RGBA", "png", 4), ("L", "jpg", None)],
+)
+@pytest.mark.parametrize("size", [(64, 48), (131, 97)])
+def test_channel_means_match_getdata(tmp_path, mode, suffix, channels, size):
+    rng = np.random.default_rng(size[0] * 7 + len(mode))
+    shape = (size[1], size[0], channels) if channels else (size[1], size[0])
+    image = tmp_path / f"frame.{suffix}"
+    Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode).save(image)
+
+    assert channel_means(load_rgb_array(image)) == getdata_means(image)
+
+
+def test_channel_means_of_empty_frame():
+    assert channel_means(np.zeros((0, 0, 3), np.uint8)) == (0.0, 0.0, 0.0)
@@ -1,47 +1,105 @@
-import PIL
-from astral import LocationInfo
-from astral.sun import sun
-from datetime import datetime
-import pytz
 import os
 import shutil
-import boto3
+import threading
+import time
+import hashlib
 from datetime import datetime, timedelta
-from botocore.exceptions import NoCredentialsError
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from env import (
     AWS_ACCESS_KEY,
     AWS_SECRET_KEY,
 )
 from pathlib import Path
 from logger import logger
-import psutil
+from metrics import metrics
+from sun_table import sun_time
 import gc
 
+# boto3, botocore, psutil and pytz are imported inside the functions that use
+# them: the scheduler imports this module and then sleeps most of the day, and
+# boto3 alone costs seconds and tens of MB on a Pi.
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+
 DIR = Path(__file__).parent.resolve()
 
+# Shared across every upload/download so credentials, endpoint resolution and
+# pooled keep-alive connections are set up once per process.
+S3_MAX_POOL_CONNECTIONS = 10
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Get the shared S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, so one client with a connection pool is
+    shared by all helpers. Set S3_ENDPOINT_URL to point it at a local S3
+    stand-in such as a moto server.
+
+    :return: A boto3 S3 client
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+
+                session = boto3.Session(
+                    aws_access_key_id=AWS_ACCESS_KEY,
+                    aws_secret_access_key=AWS_SECRET_KEY,
+                )
+                _s3_client = session.client(
+                    "s3",
+                    endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 5, "mode": "standard"},
+                    ),
+                )
+    return _s3_client
+
+
+def reset_s3_client() -> None:
+    """
+    Drop the shared S3 client so the next call creates a fresh one.
+    """
+    global _s3_client
+    with _s3_client_lock:
+        _s3_client = None
+
 
-def upload_to_s3(local_file: str, s3_object: str, bucket: str = "thesunset") -> bool:
+def upload_to_s3(
+    local_file: str,
+    s3_object: str,
+    bucket: str = "thesunset",
+    transfer_config: "TransferConfig" = None,
+) -> bool:
     """
     Upload a file to an S3 bucket using access keys
 
     :param local_file: Path to local file
     :param bucket: Target S3 bucket name
     :param s3_object: Custom object name (optional)
+    :param transfer_config: Optional multipart/threading settings
     :return: True if successful, False otherwise
     """
-    # Create session with explicit credentials
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY
-    )
+    from botocore.exceptions import NoCredentialsError
 
-    s3 = session.client("s3")
+    s3 = get_s3_client()
 
     try:
-        s3.upload_file(
-            Filename=local_file,
-            Bucket=bucket,
-            Key=s3_object or local_file,  # Use local path if no custom name
-        )
+        with metrics.stage("upload", nbytes=os.path.getsize(local_file)):
+            s3.upload_file(
+                Filename=local_file,
+                Bucket=bucket,
+                Key=s3_object or local_file,  # Use local path if no custom name
+                Config=transfer_config,
+            )
         logger.info(
             f"✅ Successfully uploaded {local_file} to {bucket} at {s3_object or local_file}"
         )
@@ -68,15 +126,13 @@ def download_from_s3(
     :param bucket: Source S3 bucket name
     :return: True if successful, False otherwise
     """
-    # Create session with explicit credentials
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY
-    )
+    from botocore.exceptions import NoCredentialsError
 
-    s3 = session.client("s3")
+    s3 = get_s3_client()
 
     try:
-        s3.download_file(Bucket=bucket, Key=s3_object, Filename=local_file)
+        with metrics.stage("download"):
+            s3.download_file(Bucket=bucket, Key=s3_object, Filename=local_file)
         logger.info(f"✅ Successfully downloaded {s3_object} to {local_file}")
         return True
     except FileNotFoundError:
@@ -145,7 +201,7 @@ def find_sunset_time(
     longitude: float = -73.94263482667436,
     date: datetime = None,
 ) -> datetime:
-    """Find the sunset time for a given city using the Astral library.
+    """Find the sunset time for a given city from the precomputed sun table.
     Args:
         city_name (str): Name of the city.
         region_name (str): Name of the region.
@@ -156,36 +212,54 @@ def find_sunset_time(
     """
     if date is None:
         # Get current date in the target timezone instead of naive local time
+        import pytz
+
         target_tz = pytz.timezone(timezone_name)
         date = datetime.now(target_tz).date()
     elif hasattr(date, "date"):
         # If datetime object passed, extract just the date part
         date = date.date()
 
-    city = LocationInfo(
-        name=city_name,
-        region=region_name,
-        timezone=timezone_name,
-        latitude=latitude,
-        longitude=longitude,
+    # Served from the persisted per-location table, astral only runs on a miss
+    return sun_time(
+        city_name, region_name, timezone_name, latitude, longitude, date, "sunset"
     )
 
-    s = sun(city.observer, date=date, tzinfo=pytz.timezone(city.timezone))
-    sunset = s["sunset"]
 
-    return sunset.astimezone(pytz.timezone(city.timezone))
+def parse_image_time(image: str) -> datetime:
+    """Parse the capture time from an image filename or path.
+
+    Accepts both the "%Y%m%d_%H%M%S" names written now and the older
+    minute-resolution "%Y%m%d_%H%M" names.
+
+    Args:
+        image (str): Image filename or path, e.g. "20250704_201530.jpg".
+
+    Returns:
+        datetime: Naive local capture time.
+    """
+    stem = Path(image).name.split(".")[0]
+    fmt = "%Y%m%d_%H%M%S" if len(stem) == 15 else "%Y%m%d_%H%M"
+    return datetime.strptime(stem, fmt)
 
 
 def determine_start_end_time(
-    when: str = "today", before_sun: int = 30, after_sun: int = 15
+    when: str = "today",
+    before_sun: int = 30,
+    after_sun: int = 15,
+    now: datetime = None,
 ) -> tuple:
     """
     Determine the start and end time for capturing images.
+
+    Args:
+        now (datetime, optional): The current time. Defaults to the system clock.
     """
+    now = now or datetime.now()
     if when == "today":
-        date = datetime.now()
+        date = now
     elif when == "tomorrow":
-        date = datetime.now() + timedelta(days=1)
+        date = now + timedelta(days=1)
 
     sunset = find_sunset_time(date=date)
     start_time = sunset - timedelta(minutes=before_sun)
@@ -213,31 +287,143 @@ def upload_folder_s3(
     folder_path: Path = DIR / "tmp/",
     s3_folder: str = "images/",
     bucket: str = "thesunset",
-) -> bool:
+    max_workers: int = 4,
+    multipart_threshold_mb: int = 16,
+    multipart_chunksize_mb: int = 8,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    skip_existing: bool = True,
+    include=None,
+) -> dict:
     """
-    Save a folder to S3.
+    Save a folder to S3 with a bounded pool of concurrent uploads.
+
+    Each file is retried with exponential backoff. With skip_existing, files
+    whose object already exists with the same size (and, for single-part
+    uploads, the same MD5 ETag) are skipped, so an interrupted archive
+    resumes cheaply.
 
     Args:
         folder_path (Path): The path to the folder to upload.
         bucket (str): The target S3 bucket name.
         s3_folder (str): The S3 folder path where files will be uploaded.
+        max_workers (int): Number of files uploaded concurrently.
+        multipart_threshold_mb (int): Size above which multipart upload is used.
+        multipart_chunksize_mb (int): Size of each multipart part.
+        max_retries (int): Upload attempts per file.
+        backoff (float): Seconds before the first retry, doubled each retry.
+        skip_existing (bool): Skip files already present in S3.
+        include (callable, optional): Only upload filenames for which this
+            returns True. Defaults to every file.
 
     Returns:
-        bool: True if successful, False otherwise.
+        dict: filename -> {"status": "uploaded" | "skipped" | "failed",
+            "bytes": int, "attempts": int}. Empty if the folder is missing.
     """
+    folder_path = Path(folder_path)
     if not os.path.exists(folder_path):
         logger.error(f"Folder {folder_path} does not exist.")
-        return False
+        return {}
+
+    from boto3.s3.transfer import TransferConfig
+
+    transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold_mb * 1024 * 1024,
+        multipart_chunksize=multipart_chunksize_mb * 1024 * 1024,
+        use_threads=False,  # concurrency comes from the file-level pool
+    )
 
-    for filename in os.listdir(folder_path):
+    def upload(filename: str) -> dict:
         local_file = folder_path / filename
         s3_object = f"{s3_folder}{filename}"
-        upload_to_s3(str(local_file), s3_object, bucket)
+        try:
+            size = local_file.stat().st_size
+        except OSError as e:
+            logger.error(f"❌ Cannot upload {filename}: {e}")
+            return {"status": "failed", "bytes": 0, "attempts": 0}
+
+        if skip_existing and _s3_object_matches(
+            local_file, s3_object, bucket, size, transfer_config.multipart_threshold
+        ):
+            logger.info(f"Skipping {filename}, already in {bucket} at {s3_object}")
+            return {"status": "skipped", "bytes": size, "attempts": 0}
+
+        for attempt in range(1, max_retries + 1):
+            if upload_to_s3(str(local_file), s3_object, bucket, transfer_config):
+                return {"status": "uploaded", "bytes": size, "attempts": attempt}
+            if attempt < max_retries:
+                delay = backoff * 2 ** (attempt - 1)
+                logger.info(f"Retrying {filename} in {delay:.1f} seconds...")
+                time.sleep(delay)
+        return {"status": "failed", "bytes": size, "attempts": max_retries}
+
+    filenames = sorted(
+        f
+        for f in os.listdir(folder_path)
+        if (folder_path / f).is_file() and (include is None or include(f))
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        report = dict(zip(filenames, executor.map(upload, filenames)))
 
-    return True
+    counts = {}
+    for result in report.values():
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info(f"Uploaded folder {folder_path} to {bucket}/{s3_folder}: {counts}")
+
+    return report
+
+
+def _s3_object_matches(
+    local_file: Path, s3_object: str, bucket: str, size: int, multipart_threshold: int
+) -> bool:
+    """
+    Check whether an S3 object already holds this file's contents.
+
+    Multipart ETags are not plain MD5s, so above the threshold only the size
+    is compared. If S3 cannot be reached the object is treated as missing, so
+    the upload is attempted and its failure recorded.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        head = get_s3_client().head_object(Bucket=bucket, Key=s3_object)
+    except (BotoCoreError, ClientError):
+        return False
+
+    if head["ContentLength"] != size:
+        return False
+    if size >= multipart_threshold:
+        return True
+
+    try:
+        with open(local_file, "rb") as f:
+            md5 = hashlib.file_digest(f, "md5").hexdigest()
+    except OSError:
+        return False
+    return head["ETag"].strip('"') == md5
+
+
+# Memory use, in percent, above which work should not be parallelized
+MEMORY_PRESSURE_PERCENT = 85
+
+
+def memory_pressure() -> bool:
+    """
+    Cheap check for high memory use, safe to call before every scoring pass.
+
+    Unlike check_system_resources it does not collect garbage, sample the
+    CPU for a second or log anything.
+
+    Returns:
+        bool: True if memory use is above MEMORY_PRESSURE_PERCENT.
+    """
+    import psutil
+
+    return psutil.virtual_memory().percent > MEMORY_PRESSURE_PERCENT
 
 
 def check_system_resources():
+    import psutil
 
     # Force garbage collection
     gc.collect()
@@ -258,7 +444,15 @@ def check_system_resources():
     cpu_percent = psutil.cpu_percent(interval=1)
     logger.info(f"CPU usage: {cpu_percent}%")
 
-    if memory.percent > 85:
+    metrics.record_resources(
+        memory_percent=memory.percent,
+        memory_available_mb=round(memory.available / 1024 / 1024, 1),
+        disk_percent=disk.percent,
+        disk_free_mb=round(disk.free / 1024 / 1024, 1),
+        cpu_percent=cpu_percent,
+    )
+
+    if memory.percent > MEMORY_PRESSURE_PERCENT:
         logger.warning("High memory usage detected!")
         return False
 
@@ -4,11 +4,25 @@
 
 export const s3Prefix = 'https://thesunset.s3.amazonaws.com';
 
-export function getSunsetImagePath(date: string): string {
-	const path = `${s3Prefix}/${date.substring(0, 4)}-${date.substring(5, 7)}-${date.substring(8, 10)}/best_sunset.webp`;
+export type ImageSize = 'thumb' | 'medium' | 'full';
+
+// the detector uploads best_sunset_thumb.webp (320px wide), best_sunset_medium.webp
+// (1280px) and the full-size best_sunset.webp for each day
+export function getSunsetImagePath(date: string, size: ImageSize = 'full'): string {
+	const suffix = size === 'full' ? '' : `_${size}`;
+	const path = `${s3Prefix}/${date.substring(0, 4)}-${date.substring(5, 7)}-${date.substring(8, 10)}/best_sunset${suffix}.webp`;
 	return path;
 }
 
+// days from before the derivatives existed only have the full-size image
+export function fallbackToFullImage(event: Event, date: string) {
+	const img = event.currentTarget as HTMLImageElement;
+	const full = getSunsetImagePath(date);
+	if (img.src !== full) {
+		img.src = full;
+	}
+}
+
 export function formatDate(date: Date | string): string {
 	// Convert string to Date if necessary
 	if (typeof date === 'string') {
@@ -20,12 +34,90 @@ export function formatDate(date: Date | string): string {
 	return `${year}-${month}-${day}`;
 }
 
+type CompactScores = {
+	version: number;
+	days: string[];
+	max_score: number[];
+	best_image_time: string[];
+	min_to_sunset: number[];
+	// one offsets array per day, aligned with that day's scores
+	offsets: number[][];
+	scores: number[][];
+};
+
+// expand the columnar scores.compact.json into the same shape as scores.json
+function expandScores(compact: CompactScores) {
+	const data: Record<string, any> = {};
+	compact.days.forEach((day, i) => {
+		const scores: Record<string, number> = {};
+		compact.offsets[i].forEach((offset, j) => {
+			scores[String(offset)] = compact.scores[i][j];
+		});
+		data[day] = {
+			scores,
+			max_score: compact.max_score[i],
+			best_image_time: compact.best_image_time[i],
+			min_to_sunset: compact.min_to_sunset[i]
+		};
+	});
+	return data;
+}
+
+type ScoreIndex = {
+	shards?: Record<string, { etag: string; days: number }>;
+	// the shard ETags scores.json and scores.compact.json were last built from
+	aggregate?: { updated: string; shards: Record<string, string> };
+};
+
+// the detector only writes a day's month shard, so days published since the
+// aggregate was last rebuilt are fetched from the shards that changed
+async function getChangedShards(index: ScoreIndex | null) {
+	const built = index?.aggregate?.shards ?? {};
+	const changed = Object.entries(index?.shards ?? {})
+		.filter(([key, shard]) => built[key] !== shard.etag)
+		.map(([key]) => key)
+		.sort();
+	const shards = await Promise.all(
+		changed.map(async (key) => {
+			try {
+				const response = await fetch(`${s3Prefix}/${key}`);
+				return response.ok ? await response.json() : {};
+			} catch (error) {
+				console.error(`Error fetching sunset scores shard ${key}:`, error);
+				return {};
+			}
+		})
+	);
+	return Object.assign({}, ...shards);
+}
+
+async function getScoreIndex(): Promise<ScoreIndex | null> {
+	try {
+		const response = await fetch(`${s3Prefix}/scores/index.json`);
+		return response.ok ? await response.json() : null;
+	} catch (error) {
+		console.error('Error fetching sunset scores index:', error);
+		return null;
+	}
+}
+
 export async function getScores() {
+		const changed = getScoreIndex().then(getChangedShards);
+		try {
+			// gzip-precompressed and columnar, the browser decompresses it for us
+			const response = await fetch(`${s3Prefix}/scores.compact.json`);
+			if (response.ok) {
+				return { ...expandScores(await response.json()), ...(await changed) };
+			}
+		} catch (error) {
+			console.error('Error fetching compact sunset scores:', error);
+		}
+
 		const url = `${s3Prefix}/scores.json`;
 		try {
 			const response = await fetch(url);
 			const data = await response.json();
-			return data;
+			return { ...data, ...(await changed) };
 		} catch (error) {
 			console.error('Error fetching sunset scores:', error);
 		}